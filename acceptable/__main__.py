@@ -1,16 +1,22 @@
 # Copyright 2017 Canonical Ltd.  This software is licensed under the
 # GNU Lesser General Public License version 3 (see the file LICENSE).
 import argparse
+import hashlib
+import importlib.metadata
 import json
+import multiprocessing
 import os
 import sys
+import sysconfig
 from collections import OrderedDict, defaultdict
+from functools import lru_cache, partial
 from importlib import import_module
 
 import yaml
 from jinja2 import ChoiceLoader, Environment, FileSystemLoader, PackageLoader
 
-from acceptable import get_metadata, lint, openapi
+from acceptable import _service, get_metadata, lint, openapi
+from acceptable._service import InvalidAPI
 from acceptable.dummy_importer import DummyImporterContext
 
 
@@ -78,6 +84,8 @@ def parse_args(raw_args=None, parser_cls=None, stdin=None, stdout=None):
         default=stdout,
         help="metadata output file path, uses stdout if omitted",
     )
+    add_jobs_argument(metadata_parser)
+    add_cache_argument(metadata_parser)
     metadata_parser.set_defaults(func=metadata_cmd)
 
     render_parser = subparser.add_parser(
@@ -138,6 +146,24 @@ def parse_args(raw_args=None, parser_cls=None, stdin=None, stdout=None):
         default=False,
         help="Update metadata even if linting fails",
     )
+    lint_parser.add_argument(
+        "--format",
+        choices=sorted(LINT_WRITERS),
+        default="text",
+        help="Output format for lint messages",
+    )
+    lint_parser.add_argument(
+        "--changed-only",
+        action="store_true",
+        default=False,
+        help="Only lint APIs that differ from the metadata file",
+    )
+    add_jobs_argument(
+        lint_parser,
+        help="Import each module and lint in separate processes, running this "
+        "many processes in parallel",
+    )
+    add_cache_argument(lint_parser)
 
     lint_parser.set_defaults(func=lint_cmd)
 
@@ -156,15 +182,94 @@ def parse_args(raw_args=None, parser_cls=None, stdin=None, stdout=None):
     version_parser.add_argument(
         "modules", nargs="*", help="Optional modules to import for current imported API"
     )
+    add_cache_argument(version_parser)
     version_parser.set_defaults(func=version_cmd)
 
     return parser.parse_args(raw_args)
 
 
+def add_jobs_argument(
+    parser,
+    help="Import each module in a separate process, running this many "
+    "processes in parallel",
+):
+    parser.add_argument("--jobs", "-j", type=int, default=None, help=help)
+
+
+def add_cache_argument(parser):
+    parser.add_argument(
+        "--cache",
+        default=None,
+        help="Cache the metadata of each module in this file, and only import "
+        "modules again when their source files change",
+    )
+
+
 def metadata_cmd(cli_args):
-    import_metadata(cli_args.modules, cli_args.dummy_dependencies)
-    current, _ = get_metadata().serialize()
-    cli_args.output.write(json.dumps(current, indent=2))
+    current, _ = get_current_metadata(
+        cli_args.modules, cli_args.dummy_dependencies, cli_args.jobs, cli_args.cache
+    )
+    write_json(current, cli_args.output)
+
+
+def get_current_metadata(
+    module_paths, dummy_dependencies=False, jobs=None, cache_path=None
+):
+    """Import modules and return their serialized metadata and locations.
+
+    If `jobs` is given, modules are imported in parallel processes, see
+    `extract_metadata_parallel`. If `cache_path` is given, modules are only
+    imported if they have changed, see `extract_metadata_cached`.
+    """
+    current, locations, _ = import_current_metadata(
+        module_paths, dummy_dependencies, jobs, cache_path
+    )
+    return current, locations
+
+
+def import_current_metadata(
+    module_paths, dummy_dependencies=False, jobs=None, cache_path=None
+):
+    """Return metadata and locations as `get_current_metadata` does.
+
+    Also returns a function writing the OpenAPI specification of the same
+    apis to a stream, without importing them again.
+    """
+    if cache_path is not None:
+        extracted = extract_metadata_cached(
+            module_paths, cache_path, jobs or 1, dummy_dependencies
+        )
+    elif jobs:
+        extracted = extract_metadata_parallel(module_paths, jobs, dummy_dependencies)
+    else:
+        import_metadata(module_paths, dummy_dependencies)
+        metadata = get_metadata()
+        metadata.check_schemas()
+        current, locations = metadata.serialize()
+        details = openapi.serialize_details(metadata)
+        return current, locations, partial(openapi.dump_serialized, current, details)
+
+    current, locations = merge_metadata(extracted)
+    details = merge_openapi_details(extracted)
+    return current, locations, partial(openapi.dump_serialized, current, details)
+
+
+def write_json(data, stream, buffer_size=64 * 1024):
+    """Write `data` to `stream` as `json.dumps(data, indent=2)` would.
+
+    The JSON is written in chunks as it is encoded, rather than building the
+    whole string in memory first.
+    """
+    buffer = []
+    size = 0
+    for chunk in json.JSONEncoder(indent=2).iterencode(data):
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            stream.write("".join(buffer))
+            buffer = []
+            size = 0
+    stream.write("".join(buffer))
 
 
 def add_working_dir_to_python_path():
@@ -215,6 +320,300 @@ def import_metadata(module_paths, dummy_dependencies=False):
         import_metadata_real_dependencies(module_paths)
 
 
+def extract_metadata_parallel(module_paths, jobs, dummy_dependencies=False):
+    """Return `extract_metadata` for each module, each in its own process.
+
+    Pass the result to `merge_metadata` to get the serialized metadata and
+    locations, as `APIMetadata.serialize` returns for modules imported in this
+    process. Locations have the name of their module, rather than the module
+    itself.
+    """
+    extract = partial(extract_metadata, dummy_dependencies=dummy_dependencies)
+    # a fresh process for each module, so they do not see each other's apis
+    with multiprocessing.Pool(jobs, maxtasksperchild=1) as pool:
+        return pool.map(extract, module_paths, chunksize=1)
+
+
+def extract_metadata_cached(module_paths, cache_path, jobs=1, dummy_dependencies=False):
+    """Return `extract_metadata` for each module, as `extract_metadata_parallel`
+    does, using a cache.
+
+    The cache file records the metadata extracted from each module, and the
+    hashes of the source files it was extracted from. Only modules with
+    changed source files are imported again, each in its own process.
+    """
+    cache = load_extraction_cache(cache_path)
+    hashes = {}
+    stale = [
+        path
+        for path in module_paths
+        if not is_fresh(cache.get(path), dummy_dependencies, hashes)
+    ]
+    if stale:
+        extract = partial(
+            extract_metadata, dummy_dependencies=dummy_dependencies, record_files=True
+        )
+        with multiprocessing.Pool(min(jobs, len(stale)), maxtasksperchild=1) as pool:
+            cache.update(zip(stale, pool.map(extract, stale, chunksize=1)))
+        save_extraction_cache(cache_path, cache)
+    return [cache[path] for path in module_paths]
+
+
+EXTRACTION_CACHE_VERSION = 3
+
+
+def extraction_cache_key():
+    """Return what the cache was extracted with, other than the source files.
+
+    Standard library files are not hashed, so the python version is included.
+    """
+    try:
+        version = importlib.metadata.version("acceptable")
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+    return [EXTRACTION_CACHE_VERSION, version, sys.version]
+
+
+def load_extraction_cache(path):
+    """Load the extracted metadata cache, or return an empty one."""
+    try:
+        with open(path) as f:
+            cache = json.load(f, object_pairs_hook=OrderedDict)
+        if cache["key"] != extraction_cache_key():
+            return {}
+        modules = cache["modules"]
+        for extracted in modules.values():
+            # restore what JSON does not have: int keys and tuples
+            convert_changelog_keys(extracted["metadata"])
+            for api_locations in extracted["locations"].values():
+                api_locations["changelog"] = OrderedDict(
+                    (int(version), location)
+                    for version, location in api_locations["changelog"].items()
+                )
+            extracted["groups"] = [tuple(group) for group in extracted["groups"]]
+    except Exception:
+        # missing, corrupt, or written by another version of acceptable
+        return {}
+    return modules
+
+
+def save_extraction_cache(path, cache):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"key": extraction_cache_key(), "modules": cache}, f)
+    os.replace(tmp_path, path)
+
+
+def is_fresh(extracted, dummy_dependencies, hashes=None):
+    """Whether cached `extracted` metadata is still valid.
+
+    `hashes` caches file hashes across calls, as modules share source files.
+    """
+    if extracted is None or extracted["dummy_dependencies"] != dummy_dependencies:
+        return False
+    if hashes is None:
+        hashes = {}
+    for filename, file_hash in extracted["files"].items():
+        if filename not in hashes:
+            hashes[filename] = hash_file(filename)
+        if hashes[filename] != file_hash:
+            return False
+    return True
+
+
+def hash_file(filename):
+    try:
+        with open(filename, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+@lru_cache(maxsize=None)
+def _stdlib_paths():
+    paths = sysconfig.get_paths()
+
+    def prefixes(*keys):
+        return tuple(os.path.join(os.path.realpath(paths[key]), "") for key in keys)
+
+    # site-packages is usually inside the standard library directory
+    return prefixes("stdlib", "platstdlib"), prefixes("purelib", "platlib")
+
+
+def _is_stdlib_file(filename):
+    filename = os.path.realpath(filename)
+    stdlib, site_packages = _stdlib_paths()
+    return filename.startswith(stdlib) and not filename.startswith(site_packages)
+
+
+def extract_metadata(module_path, dummy_dependencies=False, record_files=False):
+    """Import a module and return its metadata, as plain JSON-able data.
+
+    Returns a dict with the "metadata" and "locations" serialized by the
+    module's apis, the "groups" they were registered in, as (service, group
+    name) pairs in registration order, and the "openapi" details from
+    `openapi.serialize_details`.
+
+    If `record_files` is true, "files" maps the source files it was extracted
+    from to their hashes. These are the files apis were registered in, and
+    the files of every module loaded, other than the standard library, as any
+    of them may define schemas or register apis.
+    """
+    _service.clear_metadata()
+    import_metadata([module_path], dummy_dependencies)
+    metadata = get_metadata()
+    metadata.check_schemas()
+    current, locations = metadata.serialize()
+    extracted = {
+        "metadata": current,
+        "locations": {
+            name: portable_locations(api_locations)
+            for name, api_locations in locations.items()
+        },
+        "groups": [(service, group.name) for service, group in metadata.groups()],
+        "openapi": openapi.serialize_details(metadata),
+        "dummy_dependencies": dummy_dependencies,
+    }
+    if record_files:
+        filenames = set()
+        if module_path.endswith(".py") and os.path.exists(module_path):
+            filenames.add(module_path)
+        # modules already loaded by this process are included, as the module
+        # may have used them without importing them again
+        for module in list(sys.modules.values()):
+            filename = getattr(module, "__file__", None)
+            if isinstance(filename, str) and os.path.exists(filename):
+                if not _is_stdlib_file(filename):
+                    filenames.add(filename)
+        for api_locations in extracted["locations"].values():
+            for key, location in api_locations.items():
+                if key != "changelog" and location is not None:
+                    filenames.add(location["filename"])
+            for location in api_locations["changelog"].values():
+                if location is not None:
+                    filenames.add(location["filename"])
+        extracted["files"] = {
+            filename: hash_file(filename) for filename in filenames if filename
+        }
+    return extracted
+
+
+def portable_locations(locations):
+    """Convert serialized api locations into plain, JSON-able dicts."""
+
+    def convert(location):
+        if location is None:
+            return None
+        module = location["module"]
+        return {
+            "filename": location["filename"],
+            "lineno": location["lineno"],
+            "module": None if module is None else module.__name__,
+        }
+
+    portable = {
+        key: convert(value) for key, value in locations.items() if key != "changelog"
+    }
+    portable["changelog"] = OrderedDict(
+        (version, convert(location))
+        for version, location in locations["changelog"].items()
+    )
+    return portable
+
+
+def merge_metadata(extracted):
+    """Merge metadata from `extract_metadata`, in the order given.
+
+    Name and url clashes are rejected as `APIMetadata.register_api` does.
+    Apis that more than one module registered from the same place, because
+    one module imports another, are only included once.
+    """
+    services = OrderedDict()
+    registered = {}
+    urls = {}
+    locations = {}
+    versions = []
+
+    for result in extracted:
+        current = result["metadata"]
+        if current["$version"] is not None:
+            versions.append(current["$version"])
+
+        for service, group_name in result["groups"]:
+            group = current[group_name]
+            groups = services.setdefault(service, OrderedDict())
+            merged = groups.get(group_name)
+            if merged is None:
+                merged = groups[group_name] = OrderedDict()
+                merged["apis"] = OrderedDict()
+                merged["title"] = group["title"]
+            docs = group.get("docs")
+            if docs is not None:
+                if merged.get("docs") is None:
+                    merged["docs"] = docs
+                elif docs not in merged["docs"]:
+                    merged["docs"] += "\n" + docs
+
+            for name, api in group["apis"].items():
+                api_locations = result["locations"][name]
+                if name in registered:
+                    if registered[name] == (api, api_locations["api"]):
+                        continue
+                    raise InvalidAPI(
+                        "API {} is already registered in service {}".format(
+                            name, service
+                        )
+                    )
+                registered[name] = (api, api_locations["api"])
+
+                if api["url"] is not None:
+                    url_key = (api["url"], tuple(api["methods"]))
+                    if url_key in urls:
+                        raise InvalidAPI(
+                            "URL {} {} is already in service {}".format(
+                                "|".join(api["methods"]), api["url"], service
+                            )
+                        )
+                    urls[url_key] = name
+
+                merged["apis"][name] = api
+                locations[name] = api_locations
+
+    metadata = OrderedDict()
+    metadata["$version"] = max(versions) if versions else None
+    for groups in services.values():
+        for group_name, group in groups.items():
+            metadata[group_name] = group
+    return metadata, locations
+
+
+def merge_openapi_details(extracted):
+    """Merge the "openapi" details from `extract_metadata`, in the order given."""
+    services = []
+    apis = {}
+    for result in extracted:
+        details = result["openapi"]
+        services += [name for name in details["services"] if name not in services]
+        apis.update(details["apis"])
+    return {"services": services, "apis": apis}
+
+
+def convert_changelog_keys(metadata):
+    """Convert the changelog keys of metadata loaded from JSON back to ints.
+
+    JSON only has string keys, and changelogs are sorted by version.
+    """
+    for group in metadata:
+        if group == "$version":
+            continue
+        apis = metadata[group]["apis"]
+        for api in apis.values():
+            int_changelog = OrderedDict()
+            for version, log in api.get("changelog", {}).items():
+                int_changelog[int(version)] = log
+            api["changelog"] = int_changelog
+
+
 def load_metadata(stream):
     """Load JSON metadata from opened stream."""
     try:
@@ -223,16 +622,7 @@ def load_metadata(stream):
         err = RuntimeError("Error parsing {}: {}".format(stream.name, e))
         raise err from e
     else:
-        # convert changelog keys back to ints for sorting
-        for group in metadata:
-            if group == "$version":
-                continue
-            apis = metadata[group]["apis"]
-            for api in apis.values():
-                int_changelog = OrderedDict()
-                for version, log in api.get("changelog", {}).items():
-                    int_changelog[int(version)] = log
-                api["changelog"] = int_changelog
+        convert_changelog_keys(metadata)
     finally:
         stream.close()
 
@@ -311,9 +701,9 @@ def render_markdown(metadata, cli_args):
 
 def lint_cmd(cli_args, stream=sys.stdout):
     metadata = load_metadata(cli_args.metadata)
-    import_metadata(cli_args.modules)
-    _metadata = get_metadata()
-    current, locations = _metadata.serialize()
+    current, locations, dump_openapi = import_current_metadata(
+        cli_args.modules, jobs=cli_args.jobs, cache_path=cli_args.cache
+    )
 
     has_errors = False
     display_level = lint.WARNING
@@ -325,32 +715,136 @@ def lint_cmd(cli_args, stream=sys.stdout):
     elif cli_args.quiet:
         display_level = lint.DOCUMENTATION
 
-    for message in lint.metadata_lint(metadata, current, locations):
-        if message.level >= display_level:
-            stream.write("{}\n".format(message))
-
-        if message.level >= error_level:
-            has_errors = True
+    def displayed(messages):
+        nonlocal has_errors
+        for message in messages:
+            if message.level >= error_level:
+                has_errors = True
+
+            if message.level >= display_level:
+                yield message
+
+    messages = lint.metadata_lint(
+        metadata,
+        current,
+        locations,
+        changed_only=cli_args.changed_only,
+        jobs=cli_args.jobs,
+    )
+    LINT_WRITERS[cli_args.format](displayed(messages), stream)
 
     if cli_args.update and (not has_errors or cli_args.force):
         json_filename = cli_args.metadata.name
         with open(json_filename, "w") as j:
-            json.dump(current, j, indent=2)
+            write_json(current, j)
 
         if json_filename.endswith("api.json"):
             openapi_filename = json_filename.replace("api.json", "openapi.yaml")
             with open(openapi_filename, "w") as o:
-                openapi.dump(_metadata, o)
+                dump_openapi(o)
 
     return 1 if has_errors else 0
 
 
+def write_lint_text(messages, stream):
+    for message in messages:
+        stream.write("{}\n".format(message))
+
+
+def write_lint_json(messages, stream):
+    """Write each message as a line of JSON."""
+    for message in messages:
+        stream.write(json.dumps(message.as_dict()))
+        stream.write("\n")
+
+
+SARIF_LEVELS = {
+    # lint warnings are the least severe messages
+    lint.WARNING: "note",
+    lint.DOCUMENTATION: "warning",
+    lint.ERROR: "error",
+}
+
+
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+
+
+def write_lint_sarif(messages, stream):
+    """Write the messages as a SARIF 2.1.0 log, as they are linted.
+
+    Each check is a rule, identified by `Message.rule_id`. The results are
+    written as the messages are yielded, and the rules they refer to are
+    written after them, in the tool's description.
+    """
+    stream.write(
+        '{"$schema": %s, "version": "2.1.0", "runs": [{"results": ['
+        % json.dumps(SARIF_SCHEMA)
+    )
+    rules = []
+    rule_indexes = {}
+    for index, message in enumerate(messages):
+        rule_id = message.rule_id
+        if rule_id not in rule_indexes:
+            rule_indexes[rule_id] = len(rules)
+            rules.append(
+                {
+                    "id": rule_id,
+                    "shortDescription": {"text": message.template.replace("{}", "...")},
+                    "defaultConfiguration": {"level": SARIF_LEVELS[message.level]},
+                }
+            )
+        record = message.as_dict()
+        result = {
+            "ruleId": rule_id,
+            "ruleIndex": rule_indexes[rule_id],
+            "level": SARIF_LEVELS[message.level],
+            "message": {
+                "text": "API {} at {}: {}".format(
+                    record["api_name"], record["name"], record["message"]
+                )
+            },
+        }
+        location = record["location"]
+        if location is not None:
+            uri = location["filename"].replace(os.sep, "/")
+            result["locations"] = [
+                {
+                    "physicalLocation": {
+                        "artifactLocation": {"uri": uri},
+                        "region": {"startLine": location["lineno"]},
+                    }
+                }
+            ]
+        result["properties"] = {"api_name": record["api_name"], "name": record["name"]}
+        if index:
+            stream.write(", ")
+        stream.write(json.dumps(result))
+    tool = {
+        "driver": {
+            "name": "acceptable",
+            "informationUri": "https://github.com/canonical/acceptable",
+            "rules": rules,
+        }
+    }
+    stream.write('], "tool": %s}]}\n' % json.dumps(tool))
+
+
+LINT_WRITERS = {
+    "text": write_lint_text,
+    "json": write_lint_json,
+    "sarif": write_lint_sarif,
+}
+
+
 def version_cmd(cli_args, stream=sys.stdout):
     metadata = load_metadata(cli_args.metadata)
     json_version = metadata["$version"]
     import_version = None
 
-    if cli_args.modules:
+    if cli_args.modules and cli_args.cache:
+        current, _ = get_current_metadata(cli_args.modules, cache_path=cli_args.cache)
+        import_version = current["$version"]
+    elif cli_args.modules:
         import_metadata(cli_args.modules)
         import_version = get_metadata().current_version
 
@@ -0,0 +1,250 @@
+# Copyright 2024 Canonical Ltd.  This software is licensed under the
+# GNU Lesser General Public License version 3 (see the file LICENSE).
+"""Compile Draft 4 JSON schemas into specialised Python validator functions.
+
+The generated code unrolls the common structural keywords (type, properties,
+required, additionalProperties and items) into plain Python checks. Error
+messages are still produced by jsonschema's own keyword implementations, and
+any part of a schema using a keyword that is not compiled is handed to a
+regular Draft4Validator, so the output always matches `validate()`.
+"""
+import numbers
+
+import jsonschema
+
+_TYPE_CHECKS = {
+    "array": "isinstance({0}, list)",
+    "boolean": "isinstance({0}, bool)",
+    "integer": "(isinstance({0}, int) and not isinstance({0}, bool))",
+    "null": "{0} is None",
+    "number": "(isinstance({0}, _Number) and not isinstance({0}, bool))",
+    "object": "isinstance({0}, dict)",
+    "string": "isinstance({0}, str)",
+}
+
+_COMPILED_KEYWORDS = {"type", "properties", "required", "additionalProperties", "items"}
+
+_keyword_validator = jsonschema.Draft4Validator({})
+
+
+def _path_parts(path):
+    parts = []
+    while path is not None:
+        path, key = path
+        parts.append(key)
+    parts.reverse()
+    return parts
+
+
+def _emit(errors, keyword, schema, instance, path):
+    validate_keyword = jsonschema.Draft4Validator.VALIDATORS[keyword]
+    location = "/" + "/".join(str(p) for p in _path_parts(path))
+    for error in validate_keyword(
+        _keyword_validator, schema[keyword], instance, schema
+    ):
+        errors.append(error.message + " at " + location)
+
+
+def _fallback(errors, validator, instance, path):
+    prefix = _path_parts(path)
+    for error in validator.iter_errors(instance):
+        parts = prefix + list(error.absolute_path)
+        errors.append(error.message + " at /" + "/".join(str(p) for p in parts))
+
+
+def _contains_ref(schema):
+    if isinstance(schema, dict):
+        return "$ref" in schema or any(_contains_ref(v) for v in schema.values())
+    elif isinstance(schema, list):
+        return any(_contains_ref(v) for v in schema)
+    return False
+
+
+def _can_compile(schema):
+    if not isinstance(schema, dict):
+        return False
+    for keyword, value in schema.items():
+        if keyword not in jsonschema.Draft4Validator.VALIDATORS:
+            continue  # annotations such as description or introduced_at
+        if keyword not in _COMPILED_KEYWORDS:
+            return False
+        if keyword == "type":
+            types = [value] if isinstance(value, str) else value
+            if not isinstance(types, list) or not all(t in _TYPE_CHECKS for t in types):
+                return False
+        elif keyword == "required":
+            if not isinstance(value, list) or not all(
+                isinstance(v, str) for v in value
+            ):
+                return False
+        elif keyword == "properties":
+            if not isinstance(value, dict):
+                return False
+        elif keyword == "additionalProperties":
+            if not isinstance(value, bool) or "patternProperties" in schema:
+                return False
+        elif keyword == "items":
+            if not isinstance(value, dict):
+                return False
+    return True
+
+
+class _SchemaCompiler:
+    def __init__(self, format_checker):
+        self.format_checker = format_checker
+        self.namespace = {
+            "_Number": numbers.Number,
+            "_emit": _emit,
+            "_fallback": _fallback,
+        }
+        self.functions = []
+        self.count = 0
+
+    def name(self, prefix, value):
+        name = "_{}{}".format(prefix, len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def compile_node(self, schema, fallback=False):
+        """Generate functions validating `schema`, returning their suffix.
+
+        Two functions are generated for each node: `_check<n>`, which appends
+        every error to a list, and `_valid<n>`, which returns a boolean as soon
+        as the outcome is known. Returns None if the schema never produces any
+        errors.
+        """
+        if fallback or not _can_compile(schema):
+            validator = jsonschema.Draft4Validator(
+                schema, format_checker=self.format_checker
+            )
+            validator_name = self.name("validator", validator)
+            return self.add_functions(
+                ["_fallback(errors, {}, x, path)".format(validator_name)],
+                ["return {}.is_valid(x)".format(validator_name)],
+            )
+
+        schema_name = self.name("schema", schema)
+        check = []
+        valid = []
+        for keyword, value in schema.items():
+            if keyword == "type":
+                types = [value] if isinstance(value, str) else value
+                is_type = " or ".join(_TYPE_CHECKS[t].format("x") for t in types)
+                check += [
+                    "if not ({}):".format(is_type or "False"),
+                    "    _emit(errors, 'type', {}, x, path)".format(schema_name),
+                ]
+                valid += ["if not ({}):".format(is_type or "False"), "    return False"]
+            elif keyword == "required" and value:
+                present = " and ".join("{!r} in x".format(v) for v in value)
+                check += [
+                    "if isinstance(x, dict) and not ({}):".format(present),
+                    "    _emit(errors, 'required', {}, x, path)".format(schema_name),
+                ]
+                valid += [
+                    "if isinstance(x, dict) and not ({}):".format(present),
+                    "    return False",
+                ]
+            elif keyword == "properties":
+                check_props = []
+                valid_props = []
+                for prop, subschema in value.items():
+                    n = self.compile_node(subschema)
+                    if n is not None:
+                        check_props += [
+                            "    if {!r} in x:".format(prop),
+                            "        _check{}(x[{!r}], (path, {!r}), errors)".format(
+                                n, prop, prop
+                            ),
+                        ]
+                        valid_props += [
+                            "    if {!r} in x and not _valid{}(x[{!r}]):".format(
+                                prop, n, prop
+                            ),
+                            "        return False",
+                        ]
+                if check_props:
+                    check += ["if isinstance(x, dict):"] + check_props
+                    valid += ["if isinstance(x, dict):"] + valid_props
+            elif keyword == "additionalProperties" and value is False:
+                known = self.name("known", frozenset(schema.get("properties", ())))
+                emit = "_emit(errors, 'additionalProperties', {}, x, path)"
+                check += [
+                    "if isinstance(x, dict):",
+                    "    for key in x:",
+                    "        if key not in {}:".format(known),
+                    "            " + emit.format(schema_name),
+                    "            break",
+                ]
+                valid += [
+                    "if isinstance(x, dict):",
+                    "    for key in x:",
+                    "        if key not in {}:".format(known),
+                    "            return False",
+                ]
+            elif keyword == "items":
+                n = self.compile_node(value)
+                if n is not None:
+                    check += [
+                        "if isinstance(x, list):",
+                        "    for index, item in enumerate(x):",
+                        "        _check{}(item, (path, index), errors)".format(n),
+                    ]
+                    valid += [
+                        "if isinstance(x, list):",
+                        "    for item in x:",
+                        "        if not _valid{}(item):".format(n),
+                        "            return False",
+                    ]
+
+        if not check:
+            return None
+        return self.add_functions(check, valid + ["return True"])
+
+    def add_functions(self, check, valid):
+        n = self.count
+        self.count += 1
+        source = ["def _check{}(x, path, errors):".format(n)]
+        source += ["    " + line for line in check]
+        source += ["def _valid{}(x):".format(n)]
+        source += ["    " + line for line in valid]
+        self.functions.append("\n".join(source))
+        return n
+
+    def build(self, schema, fallback=False):
+        root = self.compile_node(schema, fallback)
+        source = self.functions + ["def validate(instance, prefix=()):"]
+        if root is not None:
+            # most payloads are valid, so check that cheaply before
+            # collecting the detailed errors
+            source += [
+                "    if _valid{}(instance):".format(root),
+                "        return []",
+                "    path = None",
+                "    for key in prefix:",
+                "        path = (path, key)",
+                "    errors = []",
+                "    _check{}(instance, path, errors)".format(root),
+                "    return errors",
+            ]
+        else:
+            source += ["    return []"]
+        source = "\n".join(source)
+        exec(compile(source, "<acceptable compiled schema>", "exec"), self.namespace)
+        validate = self.namespace["validate"]
+        validate.source = source
+        return validate
+
+
+def compile_schema(schema, format_checker=None):
+    """Compile `schema` into a function returning a `validate()` error list.
+
+    The function takes an optional `prefix`, a sequence of keys prepended to
+    the location of every error.
+
+    Schemas containing a $ref are not compiled, as references need the
+    whole document to resolve, and are validated by a Draft4Validator.
+    """
+    if format_checker is None:
+        format_checker = jsonschema.FormatChecker()
+    return _SchemaCompiler(format_checker).build(schema, _contains_ref(schema))
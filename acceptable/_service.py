@@ -2,8 +2,9 @@
 # GNU Lesser General Public License version 3 (see the file LICENSE).
 
 """acceptable - Programmatic API Metadata for Flask apps."""
+import sys
 import textwrap
-from collections import OrderedDict
+from collections import Counter, OrderedDict
 
 from acceptable import _validation
 from acceptable.util import clean_docstring, get_callsite_location, sort_schema
@@ -25,6 +26,12 @@ class APIMetadata:
         self.api_names = set()
         self.urls = set()
         self._current_version = None
+        # indexes for the get_api* and apis_* query methods
+        self._apis_by_name = {}
+        self._apis_by_url = {}
+        self._apis_by_version = {"introduced_at": {}, "deprecated_at": {}}
+        # how many apis have a changelog entry for each version
+        self._changelog_versions = Counter()
 
     def register_service(self, service, group, docs=None, title=None):
         if service not in self.services:
@@ -58,19 +65,93 @@ class APIMetadata:
             self.urls.add(url_key)
 
         self.services[service][group][api.name] = api
+        self._index_api(api)
+
+    def _index_api(self, api):
+        self._apis_by_name[api.name] = api
+        if api.url is not None:
+            for method in api.methods:
+                self._apis_by_url.setdefault((api.url, method.upper()), api)
+        for field, index in self._apis_by_version.items():
+            version = getattr(api, field)
+            if version is not None:
+                index.setdefault(version, {})[api.name] = api
+        changelog, _ = api._changelog_items()
+        self._changelog_versions.update(changelog.keys())
+        self._update_current_version(api.introduced_at, *changelog)
+        api._metadata = self
+
+    def _reindex_url(self, api, old_url, old_methods):
+        """Move `api` in the url index after its url or methods have changed."""
+        if old_url is not None:
+            self.urls.discard((old_url, tuple(old_methods)))
+            for method in old_methods:
+                key = (old_url, method.upper())
+                if self._apis_by_url.get(key) is api:
+                    del self._apis_by_url[key]
+                    # fall back to the next api registered for the url
+                    for other in self._apis_by_name.values():
+                        if other is not api and other.url == old_url:
+                            if method.upper() in map(str.upper, other.methods):
+                                self._apis_by_url[key] = other
+                                break
+        if api.url is not None:
+            self.urls.add((api.url, tuple(api.methods)))
+            for method in api.methods:
+                self._apis_by_url.setdefault((api.url, method.upper()), api)
+
+    def _add_changelog_version(self, version):
+        self._changelog_versions[version] += 1
+        self._update_current_version(version)
+
+    def _update_current_version(self, *versions):
+        for version in versions:
+            if version is not None and (
+                self._current_version is None or version > self._current_version
+            ):
+                self._current_version = version
+
+    def _reindex_version(self, api, field, old, new):
+        """Move `api` in the `field` index after the version has changed."""
+        index = self._apis_by_version[field]
+        if old is not None:
+            apis = index[old]
+            del apis[api.name]
+            if not apis:
+                del index[old]
+        if new is not None:
+            index.setdefault(new, {})[api.name] = api
+        if field == "introduced_at":
+            if old is not None and old == self._current_version:
+                # only rescan the distinct versions if the maximum was removed
+                self._current_version = None
+                self._update_current_version(*index, *self._changelog_versions)
+            self._update_current_version(new)
+
+    def get_api(self, name):
+        """Return the api registered as `name`, or None."""
+        return self._apis_by_name.get(name)
+
+    def get_api_by_url(self, url, method="GET"):
+        """Return the api registered for `url` and `method`, or None.
+
+        Only apis with a url set on them are indexed, so this does not find
+        django apis, whose urls are resolved later. Changes to the methods in
+        an api's options are only seen when `options` itself is set.
+        """
+        return self._apis_by_url.get((url, method.upper()))
+
+    def apis_introduced_at(self, version):
+        """Return the apis introduced at `version`, in registration order."""
+        return list(self._apis_by_version["introduced_at"].get(version, {}).values())
+
+    def apis_deprecated_at(self, version):
+        """Return the apis deprecated at `version`, in registration order."""
+        return list(self._apis_by_version["deprecated_at"].get(version, {}).values())
 
     @property
     def current_version(self):
-        if self._current_version is None:
-            versions = set()
-            for service in self.services.values():
-                for group in service.values():
-                    for api in group.values():
-                        versions.add(api.introduced_at)
-                        if api._changelog:
-                            versions.add(max(api._changelog))
-            if versions:
-                self._current_version = max(versions)
+        """The latest version any api was introduced or changed at."""
         return self._current_version
 
     def bind(self, flask_app, service, group=None):
@@ -94,10 +175,34 @@ class APIMetadata:
                 self.bind(flask_app, service, group)
 
     def clear(self):
+        # so changes to the apis no longer update the indexes
+        for api in self._apis_by_name.values():
+            api._metadata = None
         self.services.clear()
         self.api_names.clear()
         self.urls.clear()
         self._current_version = None
+        self._apis_by_name.clear()
+        self._apis_by_url.clear()
+        for index in self._apis_by_version.values():
+            index.clear()
+        self._changelog_versions.clear()
+
+    def check_schemas(self):
+        """Check the schemas of all apis, and any deferred schema checks.
+
+        :raises jsonschema.SchemaError: if a schema is invalid.
+        """
+        for _, group in self.groups():
+            for api in group.values():
+                for schema in (
+                    api._request_schema,
+                    api._response_schema,
+                    api._params_schema,
+                ):
+                    if schema is not None:
+                        _validation.check_schema(schema)
+        _validation.check_schemas()
 
     def groups(self):
         for service, groups in self.services.items():
@@ -105,7 +210,11 @@ class APIMetadata:
                 yield service, group
 
     def serialize(self):
-        """Serialize into JSON-able dict, and associated locations data."""
+        """Serialize into JSON-able dict, and associated locations data.
+
+        The data for each api is cached until it changes, see
+        AcceptableAPI._serialize.
+        """
         api_metadata = OrderedDict()
         # $ char makes this come first in sort ordering
         api_metadata["$version"] = self.current_version
@@ -122,38 +231,7 @@ class APIMetadata:
                 group_metadata["docs"] = group.docs
 
             for name, api in group.items():
-                group_apis[name] = OrderedDict()
-                group_apis[name]["service"] = svc_name
-                group_apis[name]["api_group"] = group.name
-                group_apis[name]["api_name"] = api.name
-                group_apis[name]["introduced_at"] = api.introduced_at
-                group_apis[name]["methods"] = api.methods
-                group_apis[name]["request_schema"] = api.request_schema
-                group_apis[name]["response_schema"] = api.response_schema
-                group_apis[name]["params_schema"] = api.params_schema
-                group_apis[name]["doc"] = api.docs
-                group_apis[name]["changelog"] = api._changelog
-                if api.title:
-                    group_apis[name]["title"] = api.title
-                else:
-                    title = name.replace("-", " ").replace("_", " ").title()
-                    group_apis[name]["title"] = title
-
-                group_apis[name]["url"] = api.resolve_url()
-
-                if api.undocumented:
-                    group_apis[name]["undocumented"] = True
-                if api.deprecated_at is not None:
-                    group_apis[name]["deprecated_at"] = api.deprecated_at
-
-                locations[name] = {
-                    "api": api.location,
-                    "request_schema": api._request_schema_location,
-                    "response_schema": api._response_schema_location,
-                    "params_schema": api._params_schema_location,
-                    "changelog": api._changelog_locations,
-                    "view": api.view_fn_location,
-                }
+                group_apis[name], locations[name] = api._serialize(svc_name, group.name)
 
         return api_metadata, locations
 
@@ -173,8 +251,21 @@ def clear_metadata():
     _metadata = None
 
 
-class APIGroup(OrderedDict):
-    """Wrapper for collection of APIs, with associated documentation."""
+def default_title(api_name):
+    """Return the title used for apis without one."""
+    return api_name.replace("-", " ").replace("_", " ").title()
+
+
+class APIGroup(dict):
+    """Wrapper for collection of APIs, with associated documentation.
+
+    This was an OrderedDict subclass. It is a plain dict, as that takes less
+    memory per api, and OrderedDict subclasses cannot drop their __dict__.
+    The apis are still in registration order, but OrderedDict methods such as
+    move_to_end() are not available, and comparisons ignore the order.
+    """
+
+    __slots__ = ("name", "title", "docs")
 
     def __init__(self, name=None, docs=None, title=None):
         self.name = name
@@ -213,10 +304,11 @@ class AcceptableService:
 
         self.location = get_callsite_location()
         self.doc = None
-        module = self.location["module"]
+        # the calling module's docstring, without resolving its location
+        module_doc = sys._getframe(1).f_globals.get("__doc__")
         docs = None
-        if module and module.__doc__:
-            docs = clean_docstring(module.__doc__)
+        if module_doc:
+            docs = clean_docstring(module_doc)
         self.metadata.register_service(name, group, docs, title)
 
     @property
@@ -303,6 +395,36 @@ class AcceptableService:
 class AcceptableAPI:
     """Metadata about an api endpoint."""
 
+    # services can define thousands of apis, so keep them compact
+    __slots__ = (
+        "service",
+        "name",
+        "_url",
+        "_introduced_at",
+        "_options",
+        "view_fn",
+        "view_fn_location",
+        "_docs",
+        "_request_schema",
+        "_request_schema_location",
+        "_response_schema",
+        "_response_schema_location",
+        "_params_schema",
+        "_params_schema_location",
+        "_sorted_schemas",
+        "request_stream",
+        "request_max_errors",
+        "response_sample_rate",
+        "_changelog_docs",
+        "_changelog_docs_locations",
+        "location",
+        "_undocumented",
+        "_deprecated_at",
+        "_title",
+        "_metadata",
+        "_serialized",
+    )
+
     def __init__(
         self,
         service,
@@ -316,6 +438,10 @@ class AcceptableAPI:
         title=None,
     ):
 
+        # the APIMetadata this api is registered with, which indexes it
+        self._metadata = None
+        # see _serialize
+        self._serialized = None
         self.service = service
         self.name = name
         self.url = url
@@ -330,8 +456,17 @@ class AcceptableAPI:
         self._response_schema_location = None
         self._params_schema = None
         self._params_schema_location = None
-        self._changelog = OrderedDict()
-        self._changelog_locations = OrderedDict()
+        # schemas are stored as given, and sorted on first use, see
+        # _sorted_schema
+        self._sorted_schemas = None
+        # streaming request validation, see _validation.validate_body
+        self.request_stream = False
+        self.request_max_errors = None
+        # overrides ACCEPTABLE_VALIDATE_OUTPUT_SAMPLE_RATE for this api
+        self.response_sample_rate = None
+        # most apis have no changelog, see changelog()
+        self._changelog_docs = None
+        self._changelog_docs_locations = None
         if location is None:
             self.location = get_callsite_location()
         else:
@@ -340,6 +475,59 @@ class AcceptableAPI:
         self.deprecated_at = deprecated_at
         self.title = title
 
+    @property
+    def url(self):
+        return self._url
+
+    @url.setter
+    def url(self, url):
+        if self._metadata is None:
+            self._url = url
+        else:
+            old_url, old_methods = self._url, self.methods
+            self._url = url
+            self._metadata._reindex_url(self, old_url, old_methods)
+
+    @property
+    def options(self):
+        return self._options
+
+    @options.setter
+    def options(self, options):
+        if self._metadata is None:
+            self._options = options
+        else:
+            old_url, old_methods = self._url, self.methods
+            self._options = options
+            self._metadata._reindex_url(self, old_url, old_methods)
+
+    @property
+    def docs(self):
+        return self._docs
+
+    @docs.setter
+    def docs(self, docs):
+        self._docs = docs
+        self._serialized = None
+
+    @property
+    def title(self):
+        return self._title
+
+    @title.setter
+    def title(self, title):
+        self._title = title
+        self._serialized = None
+
+    @property
+    def undocumented(self):
+        return self._undocumented
+
+    @undocumented.setter
+    def undocumented(self, undocumented):
+        self._undocumented = undocumented
+        self._serialized = None
+
     @property
     def methods(self):
         return list(self.options.get("methods", ["GET"]))
@@ -347,58 +535,193 @@ class AcceptableAPI:
     def resolve_url(self):
         return self.url
 
+    def _serialize(self, service, group):
+        """Return the serialized metadata and locations for this api.
+
+        These are built from a cache, which the setters of the serialized
+        attributes, changelog() and register_view() clear. The url and methods
+        are looked up every time, as django urls are only known once django
+        has been set up, and the methods can be changed in the options.
+
+        Callers get copies of the cached dicts, but the schemas and changelogs
+        in them are the api's own, so changes made to those in place are seen.
+        """
+        if self._serialized is None:
+            changelog, changelog_locations = self._changelog_items()
+            api = OrderedDict()
+            api["service"] = service
+            api["api_group"] = group
+            api["api_name"] = self.name
+            api["introduced_at"] = self.introduced_at
+            api["methods"] = None
+            api["request_schema"] = self.request_schema
+            api["response_schema"] = self.response_schema
+            api["params_schema"] = self.params_schema
+            api["doc"] = self.docs
+            api["changelog"] = changelog
+            api["title"] = self.title or default_title(self.name)
+            api["url"] = None
+
+            if self.undocumented:
+                api["undocumented"] = True
+            if self.deprecated_at is not None:
+                api["deprecated_at"] = self.deprecated_at
+
+            locations = {
+                "api": self.location,
+                "request_schema": self._request_schema_location,
+                "response_schema": self._response_schema_location,
+                "params_schema": self._params_schema_location,
+                "changelog": changelog_locations,
+                "view": self.view_fn_location,
+            }
+            self._serialized = (api, locations)
+
+        api, locations = self._serialized
+        api = api.copy()
+        api["methods"] = self.methods
+        api["url"] = self.resolve_url()
+        return api, locations.copy()
+
+    @property
+    def introduced_at(self):
+        return self._introduced_at
+
+    @introduced_at.setter
+    def introduced_at(self, version):
+        old = getattr(self, "_introduced_at", None)
+        self._introduced_at = version
+        self._serialized = None
+        if self._metadata is not None:
+            self._metadata._reindex_version(self, "introduced_at", old, version)
+
+    @property
+    def deprecated_at(self):
+        return self._deprecated_at
+
+    @deprecated_at.setter
+    def deprecated_at(self, version):
+        old = getattr(self, "_deprecated_at", None)
+        self._deprecated_at = version
+        self._serialized = None
+        if self._metadata is not None:
+            self._metadata._reindex_version(self, "deprecated_at", old, version)
+
+    def _sorted_schema(self, attr):
+        """Return the schema stored in `attr`, with its keys sorted.
+
+        Sorting large schemas is slow, so it is done on first use rather than
+        at import time, and cached until a different schema is set.
+        """
+        schema = getattr(self, attr)
+        if schema is None:
+            return None
+        if self._sorted_schemas is None:
+            self._sorted_schemas = {}
+        cached = self._sorted_schemas.get(attr)
+        if cached is None or cached[0] is not schema:
+            cached = (schema, sort_schema(schema))
+            self._sorted_schemas[attr] = cached
+        return cached[1]
+
     @property
     def request_schema(self):
-        return self._request_schema
+        return self._sorted_schema("_request_schema")
 
     @request_schema.setter
     def request_schema(self, schema):
         if schema is not None:
             _validation.validate_schema(schema)
-        self._request_schema = sort_schema(schema)
+        self._request_schema = schema
         # this location is the last item in the dict, sadly
         self._request_schema_location = get_callsite_location()
+        self._serialized = None
 
     @property
     def response_schema(self):
-        return self._response_schema
+        return self._sorted_schema("_response_schema")
 
     @response_schema.setter
     def response_schema(self, schema):
         if schema is not None:
             _validation.validate_schema(schema)
-        self._response_schema = sort_schema(schema)
+        self._response_schema = schema
         # this location is the last item in the dict, sadly
         self._response_schema_location = get_callsite_location()
+        self._serialized = None
 
     @property
     def params_schema(self):
-        return self._params_schema
+        return self._sorted_schema("_params_schema")
 
     @params_schema.setter
     def params_schema(self, schema):
         if schema is not None:
             _validation.validate_schema(schema)
-        self._params_schema = sort_schema(schema)
+        self._params_schema = schema
         self._params_schema_location = get_callsite_location()
+        self._serialized = None
+
+    # the changelog containers are created on first use, and stored, so that
+    # entries added to them are kept. Reads inside this class go through
+    # _changelog_items(), so apis without a changelog do not get them.
+    @property
+    def _changelog(self):
+        self._create_changelog()
+        return self._changelog_docs
+
+    @property
+    def _changelog_locations(self):
+        self._create_changelog()
+        return self._changelog_docs_locations
+
+    def _create_changelog(self):
+        if self._changelog_docs is None:
+            self._changelog_docs = OrderedDict()
+            self._changelog_docs_locations = OrderedDict()
+            # the serialized api has its own empty changelog
+            self._serialized = None
+
+    def _changelog_items(self):
+        """Return the changelog docs and locations, or empty dicts if unset."""
+        if self._changelog_docs is None:
+            return OrderedDict(), OrderedDict()
+        return self._changelog_docs, self._changelog_docs_locations
 
     def changelog(self, api_version, doc):
         """Add a changelog entry for this api."""
         doc = textwrap.dedent(doc).strip()
-        self._changelog[api_version] = doc
-        self._changelog_locations[api_version] = get_callsite_location()
+        self._create_changelog()
+        if self._metadata is not None and api_version not in self._changelog_docs:
+            self._metadata._add_changelog_version(api_version)
+        self._changelog_docs[api_version] = doc
+        self._changelog_docs_locations[api_version] = get_callsite_location()
+        self._serialized = None
 
     def __call__(self, fn):
         wrapped = fn
-        if self.response_schema:
-            wrapped = _validation.wrap_response(wrapped, self.response_schema)
-        if self.request_schema:
-            wrapped = _validation.wrap_request(wrapped, self.request_schema)
+        # validation does not need the sorted schemas
+        if self._response_schema:
+            wrapped = _validation.wrap_response(
+                wrapped,
+                self._response_schema,
+                sample_rate=self.response_sample_rate,
+                name=self.name,
+            )
+        if self._request_schema:
+            wrapped = _validation.wrap_request(
+                wrapped,
+                self._request_schema,
+                stream=self.request_stream,
+                max_errors=self.request_max_errors,
+                name=self.name,
+            )
 
         location = get_callsite_location()
         # this will be the lineno of the last decorator, so we want one
         # below it for the actual function
-        location["lineno"] += 1
+        if location is not None:
+            location["lineno"] += 1
         self.register_view(wrapped, location)
         return wrapped
 
@@ -407,6 +730,7 @@ class AcceptableAPI:
             raise InvalidAPI("api already has view registered")
         self.view_fn = view_fn
         self.view_fn_location = location
+        self._serialized = None
         if self.introduced_at is None:
             self.introduced_at = introduced_at
         if self.docs is None and self.view_fn.__doc__ is not None:
@@ -418,7 +742,8 @@ class AcceptableAPI:
             location = get_callsite_location()
             # this will be the lineno of the last decorator, so we want one
             # below it for the actual function
-            location["lineno"] += 1
+            if location is not None:
+                location["lineno"] += 1
 
             # convert older style version strings
             if introduced_at == "1.0":
@@ -448,6 +773,7 @@ class AcceptableAPI:
                 self._params_schema_location = getattr(
                     fn, "_params_schema_location", None
                 )
+            self._serialized = None
             return fn
 
         return decorator
@@ -1,11 +1,32 @@
 # Copyright 2017-2020 Canonical Ltd.  This software is licensed under the
 # GNU Lesser General Public License version 3 (see the file LICENSE).
+import asyncio
+import codecs
+import contextvars
 import functools
+import hashlib
+import inspect
 import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import jsonschema
 
-from acceptable.util import get_callsite_location, sort_schema
+from acceptable._compiler import compile_schema
+from acceptable.util import get_callsite_location
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger("acceptable")
 
 
 class DataValidationError(Exception):
@@ -21,7 +42,7 @@ class DataValidationError(Exception):
         return repr(self)
 
 
-def validate_params(schema):
+def validate_params(schema, compiled=False):
     """Validate the request parameters.
 
     The request parameters (request.args) are validated against the schema.
@@ -48,32 +69,38 @@ def validate_params(schema):
         def my_flask_view():
             ...
 
+    See `validate_body` for the `compiled` option.
     """
     location = get_callsite_location()
 
     def decorator(fn):
         validate_schema(schema)
-        wrapper = wrap_request_params(fn, schema)
-        record_schemas(fn, wrapper, location, params_schema=sort_schema(schema))
+        wrapper = wrap_request_params(fn, schema, compiled)
+        record_schemas(fn, wrapper, location, params_schema=schema)
         return wrapper
 
     return decorator
 
 
-def wrap_request_params(fn, schema):
+def wrap_request_params(fn, schema, compiled=False, name=None):
     from flask import request
 
-    @functools.wraps(fn)
-    def wrapper(*args, **kwargs):
-        error_list = validate(request.args, schema)
+    check = get_checker(schema, compiled)
+    if name is None:
+        name = fn.__name__
+
+    def validate_request():
+        timer = _start_timer(name)
+        error_list = check(request.args)
+        if timer is not None:
+            timer.lap("params")
         if error_list:
             raise DataValidationError(error_list)
-        return fn(*args, **kwargs)
 
-    return wrapper
+    return _wrap_before(fn, validate_request)
 
 
-def validate_body(schema):
+def validate_body(schema, compiled=False, stream=False, max_errors=None):
     """Validate the body of incoming requests for a flask view.
 
     An example usage might look like this::
@@ -114,44 +141,391 @@ def validate_body(schema):
     but this can be customised by telling flask how to handle these exceptions.
     The exception instance has an 'error_list' attribute that contains a list
     of all the errors encountered while processing the request body.
+
+    If `compiled` is true, the schema is compiled into specialised Python code
+    when the view is decorated, rather than being interpreted by jsonschema on
+    every request. The resulting error list is the same either way.
+
+    If `stream` is true, the schema must be an array with a single 'items'
+    schema. The request body is then parsed incrementally, and each item is
+    validated as soon as it has been read, rather than decoding the whole body
+    up front. The parsed array is still available to the view through
+    `request.get_json()`, so it is all kept in memory.
+
+    To not keep the items, pass a callable as `stream`. It is called with
+    each valid item as it is read, and before later items are validated, so
+    it should only collect what the view needs, for example in `flask.g`.
+    The view is still only called if the whole body is valid, but
+    `request.get_json()` is not available to it. The array schema cannot use
+    keywords other than 'type' and 'items', as they need all the items.
+
+    `max_errors` limits the number of errors reported. When streaming, the
+    rest of the body is not read once that many errors have been found.
+
+    `async def` views are supported too. Setting the flask config value
+    ACCEPTABLE_VALIDATE_IN_EXECUTOR validates their requests and responses in
+    the event loop's default executor instead of on the loop itself.
     """
     location = get_callsite_location()
 
     def decorator(fn):
         validate_schema(schema)
-        wrapper = wrap_request(fn, schema)
-        record_schemas(fn, wrapper, location, request_schema=sort_schema(schema))
+        wrapper = wrap_request(fn, schema, compiled, stream, max_errors)
+        record_schemas(fn, wrapper, location, request_schema=schema)
         return wrapper
 
     return decorator
 
 
-def wrap_request(fn, schema):
+def wrap_request(fn, schema, compiled=False, stream=False, max_errors=None, name=None):
     from flask import request
 
-    @functools.wraps(fn)
-    def wrapper(*args, **kwargs):
-        payload = request.get_json(silent=True, cache=True, force=True)
-        # If flask can't parse the payload, we want to return a sensible
-        # error message, so we try and parse it ourselves. Setting silent
-        # to False above isn't good enough, as the generated error message
-        # is not informative enough.
-        if payload is None:
-            try:
-                charset = request.mimetype_params.get("charset", "utf-8")
-                payload = json.loads(request.data.decode(charset))
-            except ValueError as e:
-                raise DataValidationError(
-                    ["Error decoding JSON request body: %s" % str(e)]
+    if stream:
+        items_schema = schema.get("items")
+        if schema.get("type") != "array" or not isinstance(items_schema, dict):
+            raise ValueError(
+                "Streaming validation requires an array schema with a single "
+                "'items' schema"
+            )
+        check_item = get_checker(items_schema, compiled)
+        array_schema = {k: v for k, v in schema.items() if k != "items"}
+        handle_item = stream if callable(stream) else None
+        if handle_item is not None:
+            keywords = set(array_schema) & set(jsonschema.Draft4Validator.VALIDATORS)
+            if keywords - {"type"}:
+                raise ValueError(
+                    "Streaming validation without keeping the items cannot "
+                    "check {}".format(", ".join(sorted(keywords - {"type"})))
                 )
-        error_list = validate(payload, schema)
+        check = get_checker(array_schema, compiled)
+    else:
+        check = get_checker(schema, compiled)
+    if name is None:
+        name = fn.__name__
+
+    def validate_request():
+        timer = _start_timer(name)
+        _check_body_size(request.content_length)
+        if stream:
+            payload, error_list = _stream_validate(
+                request, check_item, max_errors, handle_item
+            )
+            if max_errors is None or len(error_list) < max_errors:
+                error_list += check(payload)
+        else:
+            payload = _decode_body(request)
+            if timer is not None:
+                timer.lap("decode")
+            error_list = check(payload)
+        if timer is not None:
+            timer.lap("request")
         if error_list:
-            raise DataValidationError(error_list)
+            raise DataValidationError(error_list[:max_errors])
+
+    return _wrap_before(fn, validate_request)
+
+
+def _wrap_before(fn, before):
+    """Wrap `fn` so that `before()` is called ahead of it.
+
+    Coroutine functions get a coroutine wrapper, so async views are validated
+    too, and `before` may be run in an executor (see `_run_validation`).
+    """
+    if inspect.iscoroutinefunction(fn):
+
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            await _run_validation(before)
+            return await fn(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        before()
         return fn(*args, **kwargs)
 
     return wrapper
 
 
+async def _run_validation(func, *args):
+    """Call `func(*args)` from an async view.
+
+    If ACCEPTABLE_VALIDATE_IN_EXECUTOR is set, it is run in the event loop's
+    default executor, so that validating large payloads does not block the
+    loop. The current context is copied, so flask's request and app globals
+    are still available to `func`.
+    """
+    from flask import current_app
+
+    if not current_app.config.get("ACCEPTABLE_VALIDATE_IN_EXECUTOR", False):
+        return func(*args)
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, functools.partial(context.run, func, *args))
+
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def _check_body_size(size, partial=False):
+    """Reject bodies over ACCEPTABLE_MAX_BODY_SIZE.
+
+    `partial` is true if `size` is only what has been read of the body.
+    """
+    from flask import current_app
+
+    max_size = current_app.config.get("ACCEPTABLE_MAX_BODY_SIZE")
+    if max_size is not None and size is not None and size > max_size:
+        raise DataValidationError(
+            [
+                "Request body too large: %s%d bytes, maximum is %d"
+                % ("at least " if partial else "", size, max_size)
+            ]
+        )
+
+
+def _read_body(request):
+    """Read the request body, checking its size.
+
+    The Content-Length header may be missing or wrong, so at most one byte
+    more than ACCEPTABLE_MAX_BODY_SIZE is read before the body is rejected,
+    rather than reading it all and then checking its size. Returns the
+    body, and what `request.get_data()` will return once it has been read.
+    """
+    from flask import current_app
+
+    max_size = current_app.config.get("ACCEPTABLE_MAX_BODY_SIZE")
+    if max_size is None:
+        data = request.get_data(cache=True)
+        return data, data
+    chunks = []
+    size = 0
+    while size <= max_size:
+        chunk = request.stream.read(max_size + 1 - size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    _check_body_size(size, partial=True)
+    if not chunks:
+        # the view or a middleware may have read the body already, in which
+        # case the stream is empty and the body is cached by the request
+        data = request.get_data(cache=True)
+        _check_body_size(len(data))
+        return data, data
+    return b"".join(chunks), b""
+
+
+def _decode_body(request):
+    """Parse the JSON request body exactly once.
+
+    We parse it ourselves rather than using request.get_json(), so that a
+    malformed body produces an informative error message without having to
+    decode it a second time. It is still parsed by the app's JSON provider.
+    """
+    data, request_data = _read_body(request)
+    try:
+        charset = request.mimetype_params.get("charset", "utf-8")
+        payload = request.json_module.loads(data.decode(charset))
+    except ValueError as e:
+        raise DataValidationError(["Error decoding JSON request body: %s" % str(e)])
+    request.json_module = _ParsedJSON(request.json_module, request_data, payload)
+    return payload
+
+
+class _ParsedJSON:
+    """Stands in for `request.json_module` once the body has been parsed.
+
+    `request.get_json()` passes the body as the request has it to `loads`,
+    which returns the payload parsed from it rather than decoding it again.
+    Anything else is passed through to the app's JSON module.
+    """
+
+    def __init__(self, json_module, data, payload):
+        self.json_module = json_module
+        self.data = data
+        self.payload = payload
+
+    def loads(self, s, **kwargs):
+        if s == self.data:
+            return self.payload
+        return self.json_module.loads(s, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.json_module, name)
+
+
+class _NotAnArray(Exception):
+    pass
+
+
+class _JSONArrayReader:
+    """Incrementally decode the items of a JSON array from a byte stream.
+
+    The reader only buffers the undecoded remainder of the body, which is
+    bounded by the read size plus the size of the largest item, and by
+    ACCEPTABLE_MAX_BODY_SIZE. The items it yields are kept or not by the
+    caller. `data` is decoded ahead of the stream.
+    """
+
+    # how far from the end of the buffer a decoding error can be, and still
+    # be fixed by reading more, e.g. 'tru' or a partial \\uXXXX escape
+    MAX_INCOMPLETE_TOKEN = 12
+
+    def __init__(self, stream, charset, chunk_size=None, data=None):
+        self.stream = stream
+        self.decoder = codecs.getincrementaldecoder(charset)()
+        self.chunk_size = chunk_size or STREAM_CHUNK_SIZE
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.size = 0
+        # position of the buffer in the body, for error messages
+        self.offset = 0
+        self.lineno = 1
+        self.line_start = 0
+        if data is not None:
+            self.feed(data)
+
+    def read(self, size):
+        self.feed(self.stream.read(size))
+
+    def feed(self, data):
+        self.eof = not data
+        self.size += len(data)
+        # the Content-Length header may be missing, so check what was read
+        _check_body_size(self.size, partial=not self.eof)
+        text = self.decoder.decode(data, final=self.eof)
+        pos = self.pos
+        newlines = self.buffer.count("\n", 0, pos)
+        if newlines:
+            self.lineno += newlines
+            self.line_start = self.offset + self.buffer.rindex("\n", 0, pos) + 1
+        self.offset += pos
+        self.buffer = self.buffer[pos:] + text
+        self.pos = 0
+
+    def error(self, msg, pos):
+        """Return a JSONDecodeError for `pos` in the buffer.
+
+        Its position, line and column are those in the whole body, as when
+        the body is decoded in one go.
+        """
+        newlines = self.buffer.count("\n", 0, pos)
+        if newlines:
+            colno = pos - self.buffer.rindex("\n", 0, pos)
+        else:
+            colno = self.offset + pos - self.line_start + 1
+        error = json.JSONDecodeError(msg, "", 0)
+        error.pos = self.offset + pos
+        error.lineno = self.lineno + newlines
+        error.colno = colno
+        error.args = (
+            "%s: line %d column %d (char %d)"
+            % (msg, error.lineno, error.colno, error.pos),
+        )
+        return error
+
+    def next_char(self):
+        """Skip whitespace, returning the next character, or '' at the end."""
+        while True:
+            pos = self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if pos < len(self.buffer):
+                return self.buffer[pos]
+            elif self.eof:
+                return ""
+            self.read(self.chunk_size)
+
+    def read_all(self):
+        while not self.eof:
+            self.read(self.chunk_size)
+        pos = self.pos
+        return self.buffer[pos:]
+
+    def __iter__(self):
+        if self.next_char() != "[":
+            raise _NotAnArray()
+        self.pos += 1
+        if self.next_char() == "]":
+            self.pos += 1
+        else:
+            while True:
+                yield self.decode_item()
+                char = self.next_char()
+                self.pos += 1
+                if char == "]":
+                    break
+                elif char != ",":
+                    raise self.error("Expecting ',' delimiter", self.pos - 1)
+                self.next_char()
+        if self.next_char():
+            raise self.error("Extra data", self.pos)
+
+    def decode_item(self):
+        decoder = json.JSONDecoder()
+        while True:
+            try:
+                item, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                # only an error at the end of what has been read, or in a
+                # string that has not been read to its end, can be fixed by
+                # reading more
+                if self.eof or not (
+                    e.msg.startswith("Unterminated string")
+                    or e.pos >= len(self.buffer) - self.MAX_INCOMPLETE_TOKEN
+                ):
+                    raise self.error(e.msg, e.pos)
+            else:
+                # a value at the very end of the buffer may be incomplete,
+                # e.g. a number split across two reads
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return item
+            # grow reads geometrically, so a large item is not re-parsed
+            # once per chunk
+            self.read(max(self.chunk_size, len(self.buffer)))
+
+
+def _stream_validate(request, check_item, max_errors=None, handle_item=None):
+    """Parse and validate a JSON array request body one item at a time.
+
+    If `handle_item` is given, valid items are passed to it rather than kept,
+    and an empty list stands in for the array.
+    """
+    charset = request.mimetype_params.get("charset", "utf-8")
+    data = request.stream.read(STREAM_CHUNK_SIZE)
+    body = b""
+    if not data:
+        # the view or a middleware may have read the body already, in which
+        # case the stream is empty and the body is cached by the request
+        data = body = request.get_data(cache=True)
+    reader = _JSONArrayReader(request.stream, charset, data=data)
+    payload = []
+    error_list = []
+    try:
+        try:
+            for index, item in enumerate(reader):
+                item_errors = check_item(item, (index,))
+                if handle_item is None:
+                    payload.append(item)
+                elif not item_errors:
+                    handle_item(item)
+                error_list += item_errors
+                if max_errors is not None and len(error_list) >= max_errors:
+                    return payload, error_list
+        except _NotAnArray:
+            # decode the whole body, so it is reported like any other
+            payload = request.json_module.loads(reader.read_all())
+    except ValueError as e:
+        raise DataValidationError(["Error decoding JSON request body: %s" % str(e)])
+    if handle_item is None:
+        request.json_module = _ParsedJSON(request.json_module, body, payload)
+    return payload, error_list
+
+
 def record_schemas(
     fn, wrapper, location, request_schema=None, response_schema=None, params_schema=None
 ):
@@ -182,8 +556,12 @@ def record_schemas(
             fn._acceptable_metadata._response_schema = response_schema
             fn._acceptable_metadata._response_schema_location = location
 
+    if has_acceptable:
+        # the schemas were set directly, so clear the serialized api
+        fn._acceptable_metadata._serialized = None
+
 
-def validate_output(schema):
+def validate_output(schema, compiled=False, sample_rate=None):
     """Validate the body of a response from a flask view.
 
     Like `validate_body`, this function compares a json document to a
@@ -208,25 +586,44 @@ def validate_output(schema):
             return {'ok': True}
 
     Every view response will be evaluated against the schema. Any that do not
-    comply with the schema will cause DataValidationError to be raised.
+    comply with the schema are passed to the ACCEPTABLE_OUTPUT_VIOLATION_HANDLER
+    app config setting, which defaults to `raise_output_violation`. Set it to
+    `log_output_violation`, or your own callable taking the view name, error
+    list and response, to report violations without failing the request.
+
+    Validation can be disabled with the ACCEPTABLE_VALIDATE_OUTPUT setting, or
+    applied to a fraction of responses with ACCEPTABLE_VALIDATE_OUTPUT_SAMPLE_RATE
+    (between 0.0 and 1.0). `sample_rate` overrides the latter for this view.
+    To validate off the request path, see `BackgroundValidator`. It validates
+    the encoded response, decoded again by its worker, as the returned list or
+    dict may be changed by the view once it has been sent.
+
+    When orjson is installed, the response is encoded with `fast_json_dumps`,
+    unless the app's JSON provider is not flask's default one or pretty prints,
+    and with `flask.jsonify` otherwise. Set ACCEPTABLE_JSON_ENCODER to None to
+    always use `flask.jsonify`, or to a callable returning the encoded JSON.
+
+    See `validate_body` for the `compiled` option.
     """
     location = get_callsite_location()
 
     def decorator(fn):
         validate_schema(schema)
-        wrapper = wrap_response(fn, schema)
-        record_schemas(fn, wrapper, location, response_schema=sort_schema(schema))
+        wrapper = wrap_response(fn, schema, compiled, sample_rate)
+        record_schemas(fn, wrapper, location, response_schema=schema)
         return wrapper
 
     return decorator
 
 
-def wrap_response(fn, schema):
-    from flask import current_app, jsonify
+def wrap_response(fn, schema, compiled=False, sample_rate=None, name=None):
+    from flask import current_app
 
-    @functools.wraps(fn)
-    def wrapper(*args, **kwargs):
-        result = fn(*args, **kwargs)
+    check = get_checker(schema, compiled)
+    if name is None:
+        name = fn.__name__
+
+    def process_result(result):
         if isinstance(result, tuple):
             resp = result[0]
         else:
@@ -237,44 +634,403 @@ def wrap_response(fn, schema):
                 "and dict." % type(resp)
             )
 
-        if current_app.config.get("ACCEPTABLE_VALIDATE_OUTPUT", True):
-            error_list = validate(resp, schema)
-
-            assert (
-                not error_list
-            ), "Response does not comply with output schema: %r.\n%s" % (
-                error_list,
-                resp,
-            )
+        config = current_app.config
+        should_validate = config.get("ACCEPTABLE_VALIDATE_OUTPUT", True) and _sampled(
+            config, sample_rate
+        )
+        background = config.get("ACCEPTABLE_BACKGROUND_VALIDATOR")
+        timer = _start_timer(name)
+        if should_validate and background is None:
+            error_list = check(resp)
+            if timer is not None:
+                timer.lap("response")
+            if error_list:
+                handler = config.get(
+                    "ACCEPTABLE_OUTPUT_VIOLATION_HANDLER", raise_output_violation
+                )
+                handler(name, error_list, resp)
 
+        encoder = config.get("ACCEPTABLE_JSON_ENCODER", "auto")
         if isinstance(result, tuple):
-            return (jsonify(resp),) + result[1:]
+            response = (_jsonify(resp, encoder),) + result[1:]
         else:
-            return jsonify(result)
+            response = _jsonify(result, encoder)
+        if timer is not None:
+            timer.lap("encode")
+
+        if should_validate and background is not None:
+            # the view may still change `resp`, so what was sent is validated
+            body = response[0] if isinstance(response, tuple) else response
+            background.submit(check, name, body.get_data())
+        return response
+
+    if inspect.iscoroutinefunction(fn):
+
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            result = await fn(*args, **kwargs)
+            return await _run_validation(process_result, result)
+
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return process_result(fn(*args, **kwargs))
 
     return wrapper
 
 
+def _jsonify(payload, encoder=None):
+    from flask import current_app, jsonify
+
+    if encoder == "auto":
+        encoder = fast_json_dumps if _encodes_like_orjson(current_app) else None
+    if encoder is None:
+        return jsonify(payload)
+    try:
+        body = encoder(payload)
+    except TypeError:
+        # let flask deal with types the encoder does not support
+        return jsonify(payload)
+    return current_app.response_class(body, mimetype="application/json")
+
+
+def _encodes_like_orjson(app):
+    """Whether jsonify() output for `app` is what `fast_json_dumps` writes."""
+    if orjson is None:
+        return False
+    try:
+        from flask.json.provider import DefaultJSONProvider
+    except ImportError:  # flask < 2.2
+        return False
+    provider = getattr(app, "json", None)
+    if type(provider) is not DefaultJSONProvider or not provider.sort_keys:
+        return False
+    # jsonify() indents the output in debug mode, unless compact is set
+    compact = provider.compact
+    return compact or (compact is None and not app.debug)
+
+
+def fast_json_dumps(payload):
+    """Encode `payload` with orjson if it is installed, or the json module.
+
+    Types JSON does not have, such as dates, are encoded by the app's JSON
+    provider, as jsonify() does, so the output is the same either way.
+    """
+    from flask import current_app, has_app_context
+
+    default = None
+    if has_app_context():
+        default = getattr(current_app.json, "default", None)
+    if orjson is not None:
+        options = (
+            orjson.OPT_SORT_KEYS
+            | orjson.OPT_NON_STR_KEYS
+            | orjson.OPT_PASSTHROUGH_DATETIME
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+        )
+        return orjson.dumps(payload, default=default, option=options) + b"\n"
+    return (
+        json.dumps(payload, default=default, sort_keys=True, separators=(",", ":"))
+        + "\n"
+    )
+
+
+class _Timer:
+    __slots__ = ("sink", "name", "start")
+
+    def __init__(self, sink, name):
+        self.sink = sink
+        self.name = name
+        self.start = time.perf_counter()
+
+    def lap(self, phase):
+        """Report the time since the previous lap as `phase`."""
+        now = time.perf_counter()
+        self.sink(self.name, phase, now - self.start)
+        self.start = now
+
+
+_timing_sink = None
+
+
+def set_timing_sink(sink):
+    """Report the time spent validating each api to `sink`.
+
+    `sink` is a callable taking the api name, the phase and the elapsed
+    seconds, such as a `HistogramTimingSink`. Phases are "decode" and
+    "request" for request bodies, "params" for request parameters, and
+    "response" and "encode" for responses. Streamed request bodies are
+    decoded and validated together, and reported as "request" only.
+
+    Pass None, the default, to stop timing.
+    """
+    global _timing_sink
+    _timing_sink = sink
+
+
+def _start_timer(name):
+    # a module global rather than app config, so that it costs nothing
+    # when timing is disabled
+    if _timing_sink is None:
+        return None
+    return _Timer(_timing_sink, name)
+
+
+class HistogramTimingSink:
+    """Timing sink recording into a Prometheus-style histogram.
+
+    The histogram must have "api" and "phase" labels, for example::
+
+        from prometheus_client import Histogram
+
+        histogram = Histogram(
+            "acceptable_validation_seconds",
+            "Time spent in acceptable validation",
+            ["api", "phase"],
+        )
+        set_timing_sink(HistogramTimingSink(histogram))
+    """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __call__(self, name, phase, seconds):
+        self.histogram.labels(api=name, phase=phase).observe(seconds)
+
+
+def _sampled(config, sample_rate=None):
+    if sample_rate is None:
+        sample_rate = config.get("ACCEPTABLE_VALIDATE_OUTPUT_SAMPLE_RATE", 1.0)
+    return sample_rate >= 1.0 or random.random() < sample_rate
+
+
+def raise_output_violation(name, error_list, response):
+    """Fail the request when a response does not match its schema."""
+    # raised explicitly, as an assert statement is removed by python -O
+    raise AssertionError(
+        "Response does not comply with output schema: %r.\n%s" % (error_list, response)
+    )
+
+
+def log_output_violation(name, error_list, response):
+    """Log a warning when a response does not match its schema."""
+    logger.warning(
+        "Response from %s does not comply with output schema: %r", name, error_list
+    )
+
+
+class BackgroundValidator:
+    """Validate responses on a bounded pool of worker threads.
+
+    Set an instance as the ACCEPTABLE_BACKGROUND_VALIDATOR app config setting
+    to send responses without waiting for output validation. Violations are
+    passed to `on_violation`, with the same arguments as the
+    ACCEPTABLE_OUTPUT_VIOLATION_HANDLER setting.
+
+    Responses are submitted as their encoded JSON bodies, so that they cannot
+    change while they are queued, and are decoded by the worker. The decoded
+    payload is what is passed to `on_violation`.
+
+    At most `max_pending` responses are queued or being validated at once.
+    Beyond that, and after `shutdown()`, responses are not validated, and are
+    counted in `dropped`.
+    """
+
+    def __init__(self, on_violation=None, max_workers=1, max_pending=100):
+        self.on_violation = on_violation or log_output_violation
+        self.max_pending = max_pending
+        self.submitted = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix="acceptable-validation"
+        )
+
+    def submit(self, check, name, body):
+        """Queue the JSON `body` for validation, returning False if dropped."""
+        if self._slots.acquire(blocking=False):
+            try:
+                self._executor.submit(self._validate, check, name, body)
+            except RuntimeError:  # shut down
+                self._slots.release()
+            else:
+                with self._lock:
+                    self.submitted += 1
+                return True
+        with self._lock:
+            self.dropped += 1
+        return False
+
+    def _validate(self, check, name, body):
+        try:
+            response = (orjson or json).loads(body)
+            error_list = check(response)
+            if error_list:
+                self.on_violation(name, error_list, response)
+        except Exception:
+            logger.exception("Error validating response from %s", name)
+        finally:
+            self._slots.release()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
 def validate(payload, schema):
     """Validate `payload` against `schema`, returning an error list.
 
     jsonschema provides lots of information in it's errors, but it can be a bit
     of work to extract all the information.
     """
-    v = jsonschema.Draft4Validator(schema, format_checker=jsonschema.FormatChecker())
+    return _error_list(validator_cache.get(schema), payload)
+
+
+def get_checker(schema, compiled=False):
+    """Return a function validating a payload against `schema`.
+
+    If `compiled` is true, the schema is compiled ahead of time into
+    specialised Python code, otherwise a cached Draft4Validator is used.
+    Either way, the function returns the same error list as `validate()`,
+    and takes an optional `prefix` of keys prepended to each error location.
+    """
+    if compiled:
+        return compile_schema(schema, _format_checker)
+    return functools.partial(_error_list, validator_cache.get(schema))
+
+
+def _error_list(validator, payload, prefix=()):
     error_list = []
-    for error in v.iter_errors(payload):
+    for error in validator.iter_errors(payload):
         message = error.message
-        location = "/" + "/".join([str(c) for c in error.absolute_path])
+        path = list(prefix) + list(error.absolute_path)
+        location = "/" + "/".join([str(c) for c in path])
         error_list.append(message + " at " + location)
     return error_list
 
 
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class ValidatorCache:
+    """Bounded LRU cache of Draft4Validator instances, keyed on schema identity.
+
+    Each entry holds a reference to its schema, so the id used as the key
+    cannot be reused by a different schema while the entry is cached.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._validators = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, schema):
+        key = id(schema)
+        with self._lock:
+            entry = self._validators.get(key)
+            if entry is not None and entry[0] is schema:
+                self._validators.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        validator = jsonschema.Draft4Validator(schema, format_checker=_format_checker)
+        with self._lock:
+            self._validators[key] = (schema, validator)
+            self._validators.move_to_end(key)
+            while len(self._validators) > self.maxsize:
+                self._validators.popitem(last=False)
+        return validator
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._validators))
+
+    def clear(self):
+        with self._lock:
+            self._validators.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_format_checker = jsonschema.FormatChecker()
+validator_cache = ValidatorCache()
+
+
+_defer_schema_checks = os.environ.get("ACCEPTABLE_DEFER_SCHEMA_CHECKS", "0") != "0"
+# deferred schemas by id, holding the schema so the id is not reused
+_pending_schemas = OrderedDict()
+_checked_schemas = set()
+
+# processes that defer checks may never call check_schemas, so they are run
+# once this many schemas are pending, rather than keeping them all
+MAX_PENDING_SCHEMAS = 10000
+
+
+def set_defer_schema_checks(enabled):
+    """Enable or disable deferring schema checks to `check_schemas`.
+
+    Checking schemas is slow, and services usually have them checked in CI
+    already, for example by `acceptable lint`. When deferred, schemas are only
+    checked when `check_schemas` is called. This can also be enabled by
+    setting the ACCEPTABLE_DEFER_SCHEMA_CHECKS environment variable to 1.
+    """
+    global _defer_schema_checks
+    _defer_schema_checks = enabled
+
+
 def validate_schema(schema):
     """Validate that 'schema' is correct.
 
-    This validates against the jsonschema v4 draft.
+    This validates against the jsonschema v4 draft. If schema checks are
+    deferred, the schema is queued for `check_schemas` instead, until
+    MAX_PENDING_SCHEMAS are queued.
+
+    :raises jsonschema.SchemaError: if the schema is invalid.
+    """
+    if _defer_schema_checks:
+        _pending_schemas[id(schema)] = schema
+        if len(_pending_schemas) >= MAX_PENDING_SCHEMAS:
+            check_schemas()
+    else:
+        check_schema(schema)
+
+
+def check_schema(schema):
+    """Validate that 'schema' is correct, once per distinct schema content.
 
     :raises jsonschema.SchemaError: if the schema is invalid.
     """
+    key = hashlib.sha256(repr(_content_key(schema)).encode("utf-8")).digest()
+    if key in _checked_schemas:
+        return
     jsonschema.Draft4Validator.check_schema(schema)
+    _checked_schemas.add(key)
+
+
+def _content_key(value):
+    """Return a nested tuple identifying `value` by content.
+
+    Unlike JSON, it tells tuples from lists and 1 from "1", as jsonschema
+    does, so a schema is not skipped because an equivalent JSON one is valid.
+    """
+    if isinstance(value, dict):
+        items = [
+            ((type(k).__name__, repr(k)), _content_key(v)) for k, v in value.items()
+        ]
+        return ("dict", tuple(sorted(items)))
+    elif isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(_content_key(v) for v in value))
+    return (type(value).__name__, repr(value))
+
+
+def check_schemas():
+    """Check all schemas queued while schema checks were deferred.
+
+    :raises jsonschema.SchemaError: for the first invalid schema.
+    """
+    while _pending_schemas:
+        _, schema = _pending_schemas.popitem(last=False)
+        check_schema(schema)
@@ -6,7 +6,7 @@ import django
 from django.forms import fields, widgets
 
 from acceptable._service import AcceptableAPI
-from acceptable.util import clean_docstring, sort_schema
+from acceptable.util import clean_docstring
 
 logger = logging.getLogger("acceptable")
 _urlmap = None
@@ -132,6 +132,8 @@ class DjangoAPI(AcceptableAPI):
     well providing an API handler class to inspect for more metadata.
     """
 
+    __slots__ = ("_form", "handler_class")
+
     def __init__(
         self,
         service,
@@ -195,8 +197,7 @@ class DjangoAPI(AcceptableAPI):
     @django_form.setter
     def django_form(self, form):
         self._form = form
-        schema = get_form_schema(form)
-        self.request_schema = sort_schema(schema)
+        self.request_schema = get_form_schema(form)
 
     def handler(self, handler_class):
         """Link to an API handler class (e.g. piston or DRF)."""
@@ -1,6 +1,8 @@
 # Copyright 2017 Canonical Ltd.  This software is licensed under the
 # GNU Lesser General Public License version 3 (see the file LICENSE).
+import multiprocessing
 import os
+import re
 from enum import IntEnum
 
 
@@ -25,6 +27,7 @@ class Message:
         self.name = name
         self.location = kwargs.pop("location", None)
         self.api_name = kwargs.pop("api_name", None)
+        self.template = msg
         self.msg = msg.format(*args, **kwargs)
 
     def __str__(self):
@@ -41,6 +44,32 @@ class Message:
                 output,
             )
 
+    @property
+    def rule_id(self):
+        """A stable id for the check, from the class and message template.
+
+        e.g. 'LintError/cannot-delete-field' for any deleted field.
+        """
+        words = re.findall(r"[a-z_]+", self.template.replace("{}", " ").lower())
+        return "{}/{}".format(type(self).__name__, "-".join(words))
+
+    def as_dict(self):
+        """Return the message as a dict that can be encoded as JSON."""
+        location = None
+        if self.location is not None:
+            location = {
+                "filename": os.path.relpath(self.location["filename"]),
+                "lineno": self.location["lineno"],
+            }
+        return {
+            "level": self.level.name.lower(),
+            "rule_id": self.rule_id,
+            "api_name": self.api_name,
+            "name": self.name,
+            "message": self.msg,
+            "location": location,
+        }
+
 
 class LintError(Message):
     level = ERROR
@@ -60,8 +89,17 @@ class CheckChangelog(Message):
         self.revision = revision
 
 
-def metadata_lint(old, new, locations):
-    """Run the linter over the new metadata, comparing to the old."""
+def metadata_lint(old, new, locations, changed_only=False, jobs=None, context=None):
+    """Run the linter over the new metadata, comparing to the old.
+
+    If `changed_only` is true, APIs whose metadata is the same in old and new
+    are assumed to have been linted already, and are skipped.
+
+    If `jobs` is given, APIs are linted in batches by that many processes,
+    so `locations` must be picklable. They are started by the multiprocessing
+    `context`, or the default one. Messages are yielded in the same order
+    either way.
+    """
     # ensure we don't modify the metadata
     old = old.copy()
     new = new.copy()
@@ -73,20 +111,56 @@ def metadata_lint(old, new, locations):
         if old_group_name not in new:
             yield LintError("", "api group removed", api_name=old_group_name)
 
+    apis = []
     for group_name, new_group in new.items():
         old_group = old.get(group_name, {"apis": {}})
         for name, api in new_group["apis"].items():
             old_api = old_group["apis"].get(name, {})
-            api_locations = locations[name]
-            for message in lint_api(
-                name, old_api, api, api_locations, old_introduced_at
-            ):
-                message.api_name = name
-                if message.location is None:
-                    message.location = api_locations["api"]
+            if changed_only and old_api == api:
+                continue
+            apis.append((name, old_api, api, locations[name]))
+
+    if not jobs:
+        for message in _lint_apis(apis, old_introduced_at):
+            yield message
+        return
+
+    # several batches per process, so one slow batch does not hold up the rest
+    size = max(1, -(-len(apis) // (jobs * 4)))
+    batches = [(start, start + size) for start in range(0, len(apis), size)]
+    # each worker gets all the apis once, rather than with each batch: forked
+    # workers inherit them, spawned ones unpickle them when they start
+    with (context or multiprocessing).Pool(
+        jobs, _init_lint_worker, (apis, old_introduced_at)
+    ) as pool:
+        for messages in pool.imap(_lint_batch, batches):
+            for message in messages:
                 yield message
 
 
+def _lint_apis(apis, old_introduced_at):
+    for name, old_api, api, api_locations in apis:
+        for message in lint_api(name, old_api, api, api_locations, old_introduced_at):
+            message.api_name = name
+            if message.location is None:
+                message.location = api_locations["api"]
+            yield message
+
+
+_worker_args = None
+
+
+def _init_lint_worker(apis, old_introduced_at):
+    global _worker_args
+    _worker_args = apis, old_introduced_at
+
+
+def _lint_batch(batch):
+    apis, old_introduced_at = _worker_args
+    start, stop = batch
+    return list(_lint_apis(apis[start:stop], old_introduced_at))
+
+
 def lint_api(api_name, old, new, locations, old_introduced_at):
     """Lint an acceptable api metadata."""
     is_new_api = not old
@@ -123,7 +197,8 @@ def lint_api(api_name, old, new, locations, old_introduced_at):
         if old_introduced_at is not None and introduced_at <= old_introduced_at:
             yield LintError(
                 "introduced_at",
-                "introduced_at should be > {}".format(old_introduced_at),
+                "introduced_at should be > {}",
+                old_introduced_at,
                 location=api_location,
             )
 
@@ -233,37 +308,137 @@ def check_custom_attrs(name, old, new, new_api=False):
         yield CheckChangelog(name, new.get("introduced_at"))
 
 
+def resolve_ref(schema, root):
+    """Return the schema that a local `$ref` in `schema` points to in `root`.
+
+    Other keywords next to the `$ref`, such as a description, are kept.
+    Returns None if there is no local `$ref`, or it cannot be resolved.
+    """
+    ref = schema.get("$ref")
+    if not isinstance(ref, str) or not ref.startswith("#"):
+        return None
+    target = root
+    for part in ref[1:].split("/")[1:]:
+        part = part.replace("~1", "/").replace("~0", "~")
+        if isinstance(target, list) and part.isdigit() and int(part) < len(target):
+            target = target[int(part)]
+        elif isinstance(target, dict) and part in target:
+            target = target[part]
+        else:
+            return None
+    if not isinstance(target, dict):
+        return None
+    resolved = dict(target)
+    resolved.update((k, v) for k, v in schema.items() if k != "$ref")
+    return resolved
+
+
 def walk_schema(name, old, new, root=False, new_api=False):
-    if not root:
-        for i in check_custom_attrs(name, old, new, new_api):
-            yield i
-
-    types = get_schema_types(new)
-    old_types = get_schema_types(old)
-    for removed in set(old_types) - set(types):
-        yield LintError(name + ".type", "cannot remove type {} from field", removed)
-
-    # you cannot add new required fields to an existing API.
-    if not new_api:
-        old_required = old.get("required", [])
-        for removed in set(new.get("required", [])) - set(old_required):
-            yield LintError(name + ".required", "Cannot require new field {}", removed)
-
-    if "object" in types:
-        properties = new.get("properties", {})
-        old_properties = old.get("properties", {})
-
-        for deleted in set(old_properties) - set(properties):
-            yield LintError(name + "." + deleted, "cannot delete field {}", deleted)
-
-        for prop, value in sorted(properties.items()):
-            for i in walk_schema(
-                name + "." + prop, old_properties.get(prop, {}), value, new_api=new_api
-            ):
+    """Lint the changes from the `old` to the `new` schema.
+
+    Subschemas are walked depth first: properties in name order, then items,
+    then the anyOf, oneOf and allOf alternatives. Local `$ref`s are resolved
+    against the schemas passed in. Each field that uses a `$ref` has its own
+    attributes checked, but the schema it points to is only walked the first
+    time it is reached from the same old schema, so recursive and mutually
+    referencing definitions are linted once.
+    """
+    old_root = old
+    new_root = new
+    # ($ref, old $ref or schema, new api) for the referenced schemas walked
+    visited = set()
+    # name, old, new, check custom attrs, new api
+    stack = [(name, old, new, not root, new_api)]
+    push = stack.append
+    while stack:
+        name, old, new, check_attrs, new_api = stack.pop()
+
+        key = None
+        if "$ref" in new:
+            if old.get("$ref") is not None:
+                old_key = old["$ref"]
+            elif old:
+                # inline old schemas all live in old_root, so ids are stable
+                old_key = id(old)
+            else:
+                old_key = None
+            key = (new["$ref"], old_key, new_api)
+            refs = set()
+            while "$ref" in new and new["$ref"] not in refs:
+                resolved = resolve_ref(new, new_root)
+                if resolved is None:
+                    break
+                refs.add(new["$ref"])
+                new = resolved
+
+        if "$ref" in old:
+            old_refs = set()
+            while "$ref" in old and old["$ref"] not in old_refs:
+                resolved = resolve_ref(old, old_root)
+                if resolved is None:
+                    break
+                old_refs.add(old["$ref"])
+                old = resolved
+
+        if check_attrs:
+            for i in check_custom_attrs(name, old, new, new_api):
                 yield i
 
-    if "array" in types and "items" in new:
-        for i in walk_schema(
-            name + ".items", old.get("items", {}), new["items"], new_api=new_api
-        ):
-            yield i
+        if key is not None:
+            if key in visited:
+                continue
+            visited.add(key)
+
+        types = get_schema_types(new)
+        old_types = get_schema_types(old)
+        for removed in set(old_types) - set(types):
+            yield LintError(name + ".type", "cannot remove type {} from field", removed)
+
+        # you cannot add new required fields to an existing API.
+        if not new_api:
+            old_required = old.get("required", [])
+            for removed in set(new.get("required", [])) - set(old_required):
+                yield LintError(
+                    name + ".required", "Cannot require new field {}", removed
+                )
+
+        if "object" in types:
+            properties = new.get("properties", {})
+            old_properties = old.get("properties", {})
+
+            for deleted in set(old_properties) - set(properties):
+                yield LintError(name + "." + deleted, "cannot delete field {}", deleted)
+
+        # subschemas are pushed in reverse, so they are walked in order:
+        # properties, items, then the alternatives. Alternatives take their
+        # description and introduced_at from the field, and adding an anyOf
+        # or oneOf alternative accepts more.
+        for keyword in ("allOf", "oneOf", "anyOf"):
+            if keyword in new:
+                old_schemas = old.get(keyword, [])
+                for index, value in reversed(list(enumerate(new[keyword]))):
+                    is_added = index >= len(old_schemas)
+                    push(
+                        (
+                            "{}.{}[{}]".format(name, keyword, index),
+                            {} if is_added else old_schemas[index],
+                            value,
+                            False,
+                            new_api or (is_added and keyword != "allOf"),
+                        )
+                    )
+
+        if "array" in types and "items" in new:
+            push((name + ".items", old.get("items", {}), new["items"], True, new_api))
+
+        if "object" in types:
+            for prop, value in sorted(properties.items(), reverse=True):
+                push(
+                    (
+                        name + "." + prop,
+                        old_properties.get(prop, {}),
+                        value,
+                        True,
+                        new_api,
+                    )
+                )
@@ -3,13 +3,12 @@
 """acceptable - Programatic API Metadata for Flask apps."""
 
 import argparse
-import json
 import sys
 
 from django.core.management.base import BaseCommand
 
 from acceptable import get_metadata, openapi
-from acceptable.__main__ import load_metadata
+from acceptable.__main__ import load_metadata, write_json
 from acceptable.djangoutil import get_urlmap
 
 
@@ -51,7 +50,8 @@ class Command(BaseCommand):
 
     def metadata(self, _, metadata):
         _serial, _ = metadata.serialize()
-        print(json.dumps(_serial, indent=2))
+        write_json(_serial, sys.stdout)
+        sys.stdout.write("\n")
 
     def openapi(self, _, metadata):
         print(openapi.dump(metadata))
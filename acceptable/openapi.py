@@ -1,10 +1,9 @@
 """
 Helpers to translate acceptable metadata to OpenAPI specifications (OAS).
 """
-import json
 import logging
 import re
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from dataclasses import dataclass, field
 from typing import Any, Tuple
 
@@ -117,27 +116,35 @@ def tidy_string(untidy: Any):
 def convert_endpoint_to_operation(
     endpoint: AcceptableAPI, method: str, path_parameters: dict
 ):
-    _request_schema = None
-    if endpoint.request_schema:
-        _request_schema = json.loads(json.dumps(endpoint.request_schema))
-
-    _response_schema = None
-    if endpoint.response_schema:
-        _response_schema = json.loads(json.dumps(endpoint.response_schema))
-
-    query_parameters = {}
-    if endpoint.params_schema:
-        query_parameters = json.loads(json.dumps(endpoint.params_schema))
-
     return OasOperation(
         tags=[endpoint.service.group] if endpoint.service.group else [],
         summary=endpoint.title,
         description=tidy_string(endpoint.docs),
         operation_id=f"{endpoint.name}-{method}",
         path_parameters=path_parameters,
-        query_parameters=query_parameters,
-        request_schema=_request_schema,
-        response_schema=_response_schema,
+        query_parameters=endpoint.params_schema or {},
+        request_schema=endpoint.request_schema or None,
+        response_schema=endpoint.response_schema or None,
+    )
+
+
+def convert_serialized_to_operation(
+    api: dict, details: dict, method: str, path_parameters: dict
+):
+    """Convert an api from `APIMetadata.serialize` as for an `AcceptableAPI`.
+
+    The serialized api has a default title and group filled in, so the ones
+    it was given are taken from its `details`, see `serialize_details`.
+    """
+    return OasOperation(
+        tags=[details["group"]] if details["group"] else [],
+        summary=details["title"],
+        description=tidy_string(api["doc"]),
+        operation_id=f"{api['api_name']}-{method}",
+        path_parameters=path_parameters,
+        query_parameters=api["params_schema"] or {},
+        request_schema=api["request_schema"] or None,
+        response_schema=api["response_schema"] or None,
     )
 
 
@@ -181,12 +188,28 @@ def extract_path_parameters(url: str) -> Tuple[str, dict]:
     return url, parameters
 
 
-def dump(metadata: APIMetadata, stream=None):
-    oas = OasRoot31()
+try:
+    _SafeDumper = yaml.CSafeDumper
+except AttributeError:  # PyYAML built without libyaml
+    _SafeDumper = yaml.SafeDumper
+
+
+class _OasDumper(_SafeDumper):
+    """Dump schemas as they are, without copying them into plain types."""
+
+    def ignore_aliases(self, data):
+        # schemas shared between apis are written out in full each time
+        return True
+
+
+_OasDumper.add_representer(OrderedDict, yaml.representer.SafeRepresenter.represent_dict)
+_OasDumper.add_representer(tuple, yaml.representer.SafeRepresenter.represent_list)
 
+
+def _dump_oas(oas, service_names, version, tags, stream):
     _title = "None"
     try:
-        [_title] = list(metadata.services.keys())
+        [_title] = service_names
     except (TypeError, ValueError):
         logging.warning(
             "Could not extract service title from metadata. "
@@ -196,7 +219,22 @@ def dump(metadata: APIMetadata, stream=None):
         oas.info.title = _title
         oas.info.description = _title
 
-    oas.info.version = "0.0." + str(metadata.current_version)
+    oas.info.version = "0.0." + str(version)
+
+    for tag in sorted(tags):
+        oas.tags.append({"name": tag})
+
+    return yaml.dump(
+        _to_dict(oas),
+        stream,
+        Dumper=_OasDumper,
+        default_flow_style=False,
+        encoding=None,
+    )
+
+
+def dump(metadata: APIMetadata, stream=None):
+    oas = OasRoot31()
     tags = set()
 
     for service_group in metadata.services.values():
@@ -211,9 +249,48 @@ def dump(metadata: APIMetadata, stream=None):
                     tags.update(set(operation.tags))
                     oas.paths[tidy_url][method] = operation
 
-    for tag in sorted(tags):
-        oas.tags.append({"name": tag})
-
-    return yaml.safe_dump(
-        _to_dict(oas), stream, default_flow_style=False, encoding=None
+    return _dump_oas(
+        oas, list(metadata.services.keys()), metadata.current_version, tags, stream
     )
+
+
+def serialize_details(metadata: APIMetadata):
+    """Return what `dump_serialized` needs that `serialize` does not record.
+
+    These are the service names, and the title and group each api was given.
+    """
+    apis = {}
+    for service_group in metadata.services.values():
+        for api_group in service_group.values():
+            for endpoint in api_group.values():
+                apis[endpoint.name] = {
+                    "title": endpoint.title,
+                    "group": endpoint.service.group,
+                }
+    return {"services": list(metadata.services.keys()), "apis": apis}
+
+
+def dump_serialized(metadata: dict, details: dict, stream=None):
+    """Dump metadata from `APIMetadata.serialize`, as `dump` does.
+
+    This avoids walking the apis again when their metadata has already been
+    serialized, for example to be saved as well. `details` must come from
+    `serialize_details` for the same apis.
+    """
+    oas = OasRoot31()
+    tags = set()
+
+    for group_name, group in metadata.items():
+        if group_name == "$version":
+            continue
+        for name, api in group["apis"].items():
+            for method in api["methods"]:
+                method = str.lower(method)
+                tidy_url, path_parameters = extract_path_parameters(api["url"])
+                operation = convert_serialized_to_operation(
+                    api, details["apis"][name], method, path_parameters
+                )
+                tags.update(set(operation.tags))
+                oas.paths[tidy_url][method] = operation
+
+    return _dump_oas(oas, details["services"], metadata.get("$version"), tags, stream)
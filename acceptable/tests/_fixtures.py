@@ -10,7 +10,7 @@ from acceptable import _service
 
 
 def clean_up_module(name, old_syspath=None):
-    sys.modules.pop(name)
+    sys.modules.pop(name, None)
     _service.clear_metadata()
 
     if old_syspath is not None:
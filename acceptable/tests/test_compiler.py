@@ -0,0 +1,170 @@
+# Copyright 2024 Canonical Ltd.  This software is licensed under the
+# GNU Lesser General Public License version 3 (see the file LICENSE).
+import glob
+import json
+import os
+
+import flask
+from testtools import TestCase
+
+from acceptable._compiler import compile_schema
+from acceptable._validation import DataValidationError, validate, validate_body
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "examples")
+
+SCHEMAS = [
+    {"type": "object"},
+    {"type": "array"},
+    {"type": ["integer", "null"]},
+    {"type": "number"},
+    {"type": "boolean"},
+    {"required": ["bar"]},
+    {
+        "type": "object",
+        "properties": {
+            "id": {
+                "type": "string",
+                "description": "A test property.",
+                "pattern": "[0-9A-F]{8}",
+            }
+        },
+        "required": ["id"],
+    },
+    {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "snap_id": {"type": "string"},
+                "series": {"type": "string"},
+                "name": {"type": "string"},
+                "keywords": {"type": "array", "items": {"type": "string"}},
+                "created_at": {"type": "string", "format": "date-time"},
+            },
+            "required": ["snap_id", "series"],
+            "additionalProperties": False,
+        },
+    },
+    {
+        "type": "object",
+        "properties": {"ok": {"type": "boolean"}},
+        "required": ["ok"],
+        "additionalProperties": False,
+    },
+    {
+        "type": "object",
+        "properties": {"foo": {"type": "string"}},
+        "additionalProperties": {"type": "integer"},
+    },
+    {
+        "type": "object",
+        "patternProperties": {"^f": {"type": "string"}},
+        "additionalProperties": False,
+    },
+    {"type": "array", "items": [{"type": "string"}, {"type": "integer"}]},
+    {"anyOf": [{"type": "string"}, {"type": "object", "required": ["foo"]}]},
+    {
+        "definitions": {"name": {"type": "string", "minLength": 2}},
+        "type": "object",
+        "properties": {"foo": {"$ref": "#/definitions/name"}},
+    },
+    {"type": "object", "properties": {"foo": {"enum": [1, "a"], "minimum": 1}}},
+]
+
+PAYLOADS = [
+    None,
+    True,
+    0,
+    1,
+    1.5,
+    "",
+    "a",
+    [],
+    ["a", 1],
+    [{"snap_id": "a", "series": "16"}, {"snap_id": 1, "extra": True}],
+    [{"keywords": ["a", 2], "created_at": "not-a-date"}],
+    {},
+    {"foo": "x"},
+    {"foo": 1, "baz": {"bar": 2}},
+    {"foo": "x", "baz": {"bar": "y"}, "extra": [1]},
+    {"ok": True},
+    {"ok": "yes", "other": 1, "more": 2},
+    {"id": "0123ABCD"},
+    {"id": 5, "bar": None},
+    {"foo_result": 1, "bar": []},
+    {"param1": "x", "param2": "y"},
+    {"fa": "b", "fb": 1, "g": 2},
+]
+
+
+def example_schemas():
+    for path in sorted(glob.glob(os.path.join(EXAMPLES_DIR, "*api.json"))):
+        with open(path) as f:
+            metadata = json.load(f)
+        for group_name, group in metadata.items():
+            if group_name == "$version":
+                continue
+            for api in group["apis"].values():
+                for key in ("request_schema", "response_schema", "params_schema"):
+                    if api.get(key):
+                        yield api[key]
+
+
+class CompileSchemaTests(TestCase):
+    def assertParity(self, schema, payload):
+        self.assertEqual(
+            validate(payload, schema),
+            compile_schema(schema)(payload),
+            "schema: {!r}\npayload: {!r}".format(schema, payload),
+        )
+
+    def test_parity_with_validate(self):
+        for schema in SCHEMAS:
+            for payload in PAYLOADS:
+                self.assertParity(schema, payload)
+
+    def test_parity_with_example_schemas(self):
+        schemas = list(example_schemas())
+        self.assertNotEqual([], schemas)
+        for schema in schemas:
+            for payload in PAYLOADS:
+                self.assertParity(schema, payload)
+
+    def test_compiles_structural_keywords(self):
+        fn = compile_schema(SCHEMAS[8])
+        self.assertNotIn("_fallback", fn.source)
+
+    def test_falls_back_for_other_keywords(self):
+        fn = compile_schema({"type": "object", "properties": {"a": {"minimum": 3}}})
+        self.assertIn("_fallback", fn.source)
+        self.assertEqual(["1 is less than the minimum of 3 at /a"], fn({"a": 1}))
+
+    def test_valid_payload_skips_error_collection(self):
+        fn = compile_schema(SCHEMAS[7])
+
+        def fail(*args):
+            raise AssertionError("error collection should not run")
+
+        fn.__globals__["_emit"] = fail
+        fn.__globals__["_fallback"] = fail
+        self.assertEqual([], fn([{"snap_id": "a", "series": "16", "name": "x"}]))
+
+    def test_annotation_only_schema_has_no_checks(self):
+        fn = compile_schema({"description": "anything", "introduced_at": 2})
+        self.assertEqual([], fn(object()))
+
+
+class CompiledDecoratorTests(TestCase):
+    def test_validate_body_compiled(self):
+        app = flask.Flask(__name__)
+        app.testing = True
+
+        @app.route("/", methods=["POST"])
+        @validate_body({"type": "object", "required": ["foo"]}, compiled=True)
+        def view():
+            return "OK", 200
+
+        client = app.test_client()
+        self.assertEqual(200, client.post("/", json={"foo": 1}).status_code)
+        e = self.assertRaises(DataValidationError, client.post, "/", json={})
+        self.assertEqual(["'foo' is a required property at /"], e.error_list)
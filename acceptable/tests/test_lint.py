@@ -1,9 +1,12 @@
 # Copyright 2017 Canonical Ltd.  This software is licensed under the
 # GNU Lesser General Public License version 3 (see the file LICENSE).
+import json
+import multiprocessing
+
 import testtools
 
 from acceptable import get_metadata, lint
-from acceptable.__main__ import import_metadata
+from acceptable.__main__ import import_metadata, portable_locations
 from acceptable.tests.test_main import TemporaryModuleFixture
 
 
@@ -34,6 +37,66 @@ class LintTests(LintTestCase):
         list(lint.metadata_lint(metadata, metadata, locations))
         self.assertEqual(metadata, orig)
 
+    def test_changed_only(self):
+        metadata, locations, path = self.get_metadata(
+            """
+            from acceptable import *
+            service = AcceptableService('myservice', 'group')
+            api1 = service.api('/1', 'api1', introduced_at=1)
+            api2 = service.api('/2', 'api2', introduced_at=1)
+
+            @api1
+            def view1():
+                pass
+
+            @api2
+            def view2():
+                pass
+        """
+        )
+        old = json.loads(json.dumps(metadata))
+        old["group"]["apis"]["api2"]["introduced_at"] = 2
+        old["group"]["apis"]["removed"] = old["group"]["apis"]["api1"]
+
+        msgs = list(lint.metadata_lint(old, metadata, locations))
+        self.assertEqual(["api1", "api2", "api2"], [m.api_name for m in msgs])
+
+        changed = list(lint.metadata_lint(old, metadata, locations, changed_only=True))
+        self.assertEqual([str(m) for m in msgs[1:]], [str(m) for m in changed])
+
+        msgs = list(lint.metadata_lint({}, metadata, locations, changed_only=True))
+        self.assertEqual(["api1", "api2"], [m.api_name for m in msgs])
+
+    def test_jobs(self):
+        metadata, locations, path = self.get_metadata(
+            """
+            from acceptable import *
+            service = AcceptableService('myservice', 'group')
+            other = AcceptableService('myservice', 'other')
+
+            for i in range(10):
+                api = (other if i % 3 else service).api(
+                    '/{}'.format(i), 'api{}'.format(i), introduced_at=i
+                )
+                api.request_schema = {'type': 'object', 'required': ['foo']}
+        """
+        )
+        locations = {name: portable_locations(loc) for name, loc in locations.items()}
+        old = {"$version": 5, "removed": {"apis": {}}}
+
+        msgs = [str(m) for m in lint.metadata_lint(old, metadata, locations)]
+        self.assertEqual(17, len(msgs))
+        parallel = lint.metadata_lint(old, metadata, locations, jobs=2)
+        self.assertEqual(msgs, [str(m) for m in parallel])
+        spawned = lint.metadata_lint(
+            old,
+            metadata,
+            locations,
+            jobs=2,
+            context=multiprocessing.get_context("spawn"),
+        )
+        self.assertEqual(msgs, [str(m) for m in spawned])
+
     def test_missing_api_documentation(self):
         metadata, locations, path = self.get_metadata(
             """
@@ -494,6 +557,19 @@ class WalkSchemaTests(LintTestCase):
 
         self.assertIsInstance(msgs[1], lint.CheckChangelog)
 
+    def test_rule_id_is_stable(self):
+        deleted = [
+            lint.LintError("a." + field, "cannot delete field {}", field)
+            for field in ("foo", "bar")
+        ]
+        self.assertEqual(
+            ["LintError/cannot-delete-field"] * 2, [m.rule_id for m in deleted]
+        )
+        self.assertEqual(
+            "LintFixit/missing-introduced_at-field",
+            lint.LintFixit("a.introduced_at", "missing introduced_at field").rule_id,
+        )
+
     def test_missing_doc_and_introduced_when_adding_new_field(self):
         old = {"type": "object"}
 
@@ -613,6 +689,111 @@ class WalkSchemaTests(LintTestCase):
         self.assertEqual(msgs[1].level, lint.DOCUMENTATION)
         self.assertEqual("name.items.bar.introduced_at", msgs[1].name)
 
+    def test_deep_schema(self):
+        new = {"type": "string", "description": "leaf"}
+        for i in range(5000):
+            new = {"type": "object", "properties": {"a": new}}
+
+        msgs = list(lint.walk_schema("name", {}, new, root=True, new_api=True))
+        self.assertEqual(4999, len(msgs))
+        self.assertEqual("name.a.description", msgs[0].name)
+
+    def test_refs(self):
+        definitions = {
+            "foo": {
+                "type": "object",
+                "properties": {"bar": {"type": "string", "description": "bar"}},
+            }
+        }
+        old = {
+            "type": "object",
+            "definitions": definitions,
+            "properties": {"foo": {"$ref": "#/definitions/foo", "description": "x"}},
+        }
+        new = {
+            "type": "object",
+            "definitions": {
+                "foo": {
+                    "type": "object",
+                    "properties": {"bar": {"type": "integer", "description": "bar"}},
+                }
+            },
+            "properties": {"foo": {"$ref": "#/definitions/foo", "description": "x"}},
+        }
+
+        msgs = list(lint.walk_schema("name", old, new, root=True))
+        self.assertEqual(["name.foo.bar.type"], [m.name for m in msgs])
+        self.assertIn("remove type string", msgs[0].msg)
+
+    def test_recursive_refs(self):
+        new = {
+            "type": "object",
+            "description": "node",
+            "properties": {
+                "children": {"type": "array", "items": {"$ref": "#"}},
+                "missing": {"$ref": "#/definitions/missing"},
+            },
+        }
+
+        msgs = list(lint.walk_schema("name", {}, new, root=True, new_api=True))
+        self.assertEqual(
+            [
+                "name.children.description",
+                "name.children.items.children.description",
+                "name.children.items.missing.description",
+                "name.missing.description",
+            ],
+            [m.name for m in msgs],
+        )
+
+    def test_mutually_referencing_definitions(self):
+        def schema(count):
+            names = ["d{}".format(i) for i in range(count)]
+            properties = {n: {"$ref": "#/definitions/" + n} for n in names}
+            definition = {
+                "type": "object",
+                "description": "definition",
+                "properties": dict(properties, extra={"type": "string"}),
+            }
+            return {
+                "type": "object",
+                "description": "root",
+                "definitions": {n: definition for n in names},
+                "properties": properties,
+            }
+
+        # each definition is walked once, where it is first reached
+        msgs = list(lint.walk_schema("name", {}, schema(3), root=True, new_api=True))
+        self.assertEqual(
+            [
+                "name.d0.d1.d2.extra.description",
+                "name.d0.d1.extra.description",
+                "name.d0.extra.description",
+            ],
+            [m.name for m in msgs],
+        )
+        msgs = list(lint.walk_schema("name", {}, schema(12), root=True, new_api=True))
+        self.assertEqual(12, len(msgs))
+
+        new = schema(3)
+        msgs = list(lint.walk_schema("name", new, new, root=True))
+        self.assertEqual([lint.WARNING] * 3, [m.level for m in msgs])
+
+    def test_alternatives(self):
+        string = {"type": "string"}
+        foo = {"type": "string", "description": "foo"}
+        obj = {"type": "object", "properties": {"foo": foo}}
+        old = {"anyOf": [string, obj], "allOf": [{"type": "object"}]}
+        new = {
+            "anyOf": [{"type": "integer"}, obj, {"type": "object", "required": ["a"]}],
+            "allOf": [{"type": "object"}, {"type": "object", "required": ["b"]}],
+        }
+
+        msgs = list(lint.walk_schema("name", old, new, root=True))
+        self.assertEqual(
+            ["name.anyOf[0].type", "name.allOf[1].required"], [m.name for m in msgs]
+        )
+
     def test_new_api_introduced_at_enforced(self):
         old, _, _ = self.get_metadata(
             module="old",
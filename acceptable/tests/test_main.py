@@ -4,18 +4,23 @@ import argparse
 import contextlib
 import io
 import json
+import multiprocessing
 import os
+import pickle
 import subprocess
+import sys
 import tempfile
 from collections import OrderedDict
 from functools import partial
+from importlib import import_module
 
 import fixtures
 import testtools
 import yaml
 
 from acceptable import __main__ as main
-from acceptable import get_metadata
+from acceptable import get_metadata, openapi
+from acceptable._service import InvalidAPI
 from acceptable.tests._fixtures import CleanUpModuleImport, TemporaryModuleFixture
 
 
@@ -89,6 +94,15 @@ class ParseArgsTests(testtools.TestCase):
                 parser_cls=SaneArgumentParser,
             )
 
+    def test_lint_jobs_with_update(self):
+        with tempfile.NamedTemporaryFile("w") as api:
+            api.write("hi")
+            api.flush()
+            args = main.parse_args(["lint", "--jobs", "2", "--update", api.name, "foo"])
+            args.metadata.close()  # suppresses ResourceWarning
+            self.assertEqual(2, args.jobs)
+            self.assertTrue(args.update)
+
 
 class MetadataTests(testtools.TestCase):
     def test_importing_api_metadata_works(self):
@@ -250,6 +264,228 @@ class MetadataTests(testtools.TestCase):
         )
 
 
+class ParallelImportTests(testtools.TestCase):
+    services = {
+        "svc_a": """
+            'Service A.'
+            from acceptable import AcceptableService
+            service = AcceptableService('service', 'group')
+
+            api = service.api('/a', 'a', introduced_at=1)
+            api.changelog(3, "Changed.")
+        """,
+        "svc_b": """
+            'Service B.'
+            from acceptable import AcceptableService
+            service = AcceptableService('service', 'group')
+            other = AcceptableService('other', 'other')
+
+            service.api('/b', 'b', introduced_at=2)
+            other.api('/c', 'c', introduced_at=2)
+        """,
+        "svc_c": """
+            import svc_a
+            from acceptable import AcceptableService
+            service = AcceptableService('service', 'group')
+
+            service.api('/d', 'd', introduced_at=2)
+        """,
+        "svc_titles": """
+            from acceptable import AcceptableService
+            service = AcceptableService('service', 'default')
+
+            service.api('/b-title', 'get_b', title='Get B', introduced_at=1)
+            service.api('/untitled', 'untitled', introduced_at=1)
+        """,
+        "schemas_helper": """
+            SCHEMA = {'type': 'object'}
+        """,
+        "svc_helper": """
+            import schemas_helper
+            from acceptable import AcceptableService
+            service = AcceptableService('service', 'helped')
+
+            api = service.api('/helped', 'helped', introduced_at=1)
+            api.request_schema = schemas_helper.SCHEMA
+        """,
+        "svc_clash": """
+            from acceptable import AcceptableService
+            service = AcceptableService('service')
+
+            service.api('/b', 'clash', introduced_at=2)
+        """,
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.modules = {}
+        for name, code in self.services.items():
+            self.modules[name] = self.useFixture(TemporaryModuleFixture(name, code))
+
+    def assertMatchesSequential(self, modules):
+        metadata, locations = main.get_current_metadata(modules, jobs=2)
+        main.import_metadata(modules)
+        expected, expected_locations = get_metadata().serialize()
+
+        self.assertEqual(json.dumps(expected, indent=2), json.dumps(metadata, indent=2))
+        self.assertEqual(
+            main.portable_locations(expected_locations["a"]), locations["a"]
+        )
+        self.assertEqual("svc_a", locations["a"]["api"]["module"])
+
+    def test_matches_sequential_import(self):
+        self.assertMatchesSequential(["svc_a", "svc_b"])
+
+    def test_modules_importing_each_other(self):
+        self.assertMatchesSequential(["svc_c", "svc_a", "svc_b"])
+
+    def test_openapi_matches_sequential_import(self):
+        modules = ["svc_titles", "svc_a"]
+        cache_path = os.path.join(self.useFixture(fixtures.TempDir()).path, "cache")
+        outputs = []
+        for kwargs in ({"jobs": 2}, {"cache_path": cache_path}, {}):
+            *_, dump_openapi = main.import_current_metadata(modules, **kwargs)
+            outputs.append(dump_openapi())
+
+        # the last import was in this process, so dump can read its apis
+        expected = openapi.dump(get_metadata())
+        self.assertEqual([expected] * 3, outputs)
+        spec = yaml.safe_load(expected)
+        self.assertEqual([{"name": "default"}, {"name": "group"}], spec["tags"])
+        self.assertEqual("Get B", spec["paths"]["/b-title"]["get"]["summary"])
+        self.assertNotIn("summary", spec["paths"]["/untitled"]["get"])
+
+    def test_detects_clashes(self):
+        self.assertRaisesRegex(
+            InvalidAPI,
+            "URL GET /b is already in service service",
+            main.get_current_metadata,
+            ["svc_b", "svc_clash"],
+            jobs=2,
+        )
+
+    def test_metadata_cmd(self):
+        output = io.StringIO()
+        args = main.parse_args(
+            ["metadata", "--jobs", "2", "svc_a", "svc_b"], stdout=output
+        )
+        main.metadata_cmd(args)
+        self.assertEqual(
+            ["$version", "group", "other"], list(json.loads(output.getvalue()))
+        )
+
+    def test_cache_only_imports_changed_modules(self):
+        cache_path = os.path.join(self.useFixture(fixtures.TempDir()).path, "cache")
+        imported = []
+        Pool = multiprocessing.Pool
+
+        def recording_pool(*args, **kwargs):
+            pool = Pool(*args, **kwargs)
+            pool_map = pool.map
+
+            def recording_map(fn, module_paths, **kwargs):
+                imported.extend(module_paths)
+                return pool_map(fn, module_paths, **kwargs)
+
+            pool.map = recording_map
+            return pool
+
+        self.patch(multiprocessing, "Pool", recording_pool)
+        modules = ["svc_a", "svc_b"]
+
+        metadata, locations = main.get_current_metadata(modules, cache_path=cache_path)
+        self.assertEqual(["svc_a", "svc_b"], imported)
+        self.assertEqual(
+            (metadata, locations), main.get_current_metadata(modules, jobs=2)
+        )
+        del imported[:]
+
+        self.assertEqual(
+            (metadata, locations),
+            main.get_current_metadata(modules, cache_path=cache_path),
+        )
+        self.assertEqual([], imported)
+
+        with open(self.modules["svc_b"].path, "a") as f:
+            f.write("\nservice.api('/e', 'e', introduced_at=5)\n")
+        metadata, _ = main.get_current_metadata(modules, cache_path=cache_path)
+        self.assertEqual(["svc_b"], imported)
+        self.assertEqual(5, metadata["$version"])
+        self.assertEqual(["a", "b", "e"], list(metadata["group"]["apis"]))
+
+    def test_cache_is_json(self):
+        cache_path = os.path.join(self.useFixture(fixtures.TempDir()).path, "cache")
+        metadata, locations = main.get_current_metadata(
+            ["svc_a"], cache_path=cache_path
+        )
+        with open(cache_path) as f:
+            self.assertEqual(["svc_a"], list(json.load(f)["modules"]))
+
+        cache = main.load_extraction_cache(cache_path)
+        self.assertEqual([("service", "group")], cache["svc_a"]["groups"])
+        self.assertEqual([3], list(locations["a"]["changelog"]))
+        self.assertEqual(
+            (metadata, locations),
+            main.get_current_metadata(["svc_a"], cache_path=cache_path),
+        )
+
+        # caches from other versions of acceptable are not used
+        self.patch(main, "extraction_cache_key", lambda: ["other"])
+        self.assertEqual({}, main.load_extraction_cache(cache_path))
+
+        with open(cache_path, "wb") as f:
+            pickle.dump((main.EXTRACTION_CACHE_VERSION, cache), f)
+        self.assertEqual({}, main.load_extraction_cache(cache_path))
+
+    def test_cache_checks_loaded_modules(self):
+        cache_path = os.path.join(self.useFixture(fixtures.TempDir()).path, "cache")
+        # already loaded, so not imported again while extracting
+        import_module("schemas_helper")
+
+        metadata, _ = main.get_current_metadata(["svc_helper"], cache_path=cache_path)
+        schema = metadata["helped"]["apis"]["helped"]["request_schema"]
+        self.assertEqual({"type": "object"}, schema)
+        files = main.load_extraction_cache(cache_path)["svc_helper"]["files"]
+        self.assertIn(self.modules["schemas_helper"].path, files)
+        self.assertIn(main.__file__, files)
+
+        with open(self.modules["schemas_helper"].path, "w") as f:
+            f.write("SCHEMA = {'type': 'array'}\n")
+        sys.modules.pop("schemas_helper")
+        metadata, _ = main.get_current_metadata(["svc_helper"], cache_path=cache_path)
+        schema = metadata["helped"]["apis"]["helped"]["request_schema"]
+        self.assertEqual({"type": "array"}, schema)
+
+    def test_cache_option(self):
+        cache_path = os.path.join(self.useFixture(fixtures.TempDir()).path, "cache")
+        output = io.StringIO()
+        args = main.parse_args(
+            ["metadata", "--cache", cache_path, "svc_a"], stdout=output
+        )
+        main.metadata_cmd(args)
+        self.assertEqual(["svc_a"], list(main.load_extraction_cache(cache_path)))
+        self.assertEqual(3, json.loads(output.getvalue())["$version"])
+
+
+class WriteJsonTests(testtools.TestCase):
+    def test_matches_json_dumps(self):
+        data = OrderedDict(
+            [("$version", 2), ("group", {"apis": {"a": [1, "\u00e9", None]}})]
+        )
+        for buffer_size in (1, 16, 64 * 1024):
+            output = io.StringIO()
+            main.write_json(data, output, buffer_size=buffer_size)
+            self.assertEqual(json.dumps(data, indent=2), output.getvalue())
+
+    def test_metadata_cmd(self):
+        self.useFixture(CleanUpModuleImport("examples.api"))
+        output = io.StringIO()
+        args = main.parse_args(["metadata", "examples.api"], stdout=output)
+        main.metadata_cmd(args)
+        current, _ = get_metadata().serialize()
+        self.assertEqual(json.dumps(current, indent=2), output.getvalue())
+
+
 class LoadMetadataTests(testtools.TestCase):
     def metadata(self):
         metadata = OrderedDict()
@@ -572,6 +808,122 @@ class LintTests(testtools.TestCase):
         for actual, expected in zip(lines, EXPECTED_LINT_OUTPUT):
             self.assertIn(":".join(map(str, expected)), actual)
 
+    def test_changed_only(self):
+        self.useFixture(
+            TemporaryModuleFixture(
+                "changed_only_api",
+                """
+                from acceptable import AcceptableService
+                service = AcceptableService('service', 'group')
+                schema = {
+                    'type': 'object',
+                    'properties': {'a': {'type': 'string'}},
+                }
+
+                unchanged = service.api('/unchanged', 'unchanged', introduced_at=1)
+                unchanged.request_schema = schema
+                changed = service.api('/changed', 'changed', introduced_at=1)
+                changed.request_schema = schema
+                """,
+            )
+        )
+        current, _ = main.get_current_metadata(["changed_only_api"])
+        # the saved metadata does not have the changed api's docs
+        current["group"]["apis"]["changed"]["doc"] = "Documented."
+        metadata = self.useFixture(fixtures.TempDir()).join("api.json")
+        with open(metadata, "w") as f:
+            json.dump(current, f)
+
+        def lint(*options):
+            args = main.parse_args(["lint", *options, metadata, "changed_only_api"])
+            output = io.StringIO()
+            main.lint_cmd(args, stream=output)
+            return output.getvalue()
+
+        output = lint()
+        self.assertIn("API unchanged at request_schema.a.description", output)
+        self.assertIn("API changed at request_schema.a.description", output)
+        changed_output = lint("--changed-only")
+        self.assertNotIn("API unchanged at", changed_output)
+        self.assertIn("API changed at request_schema.a.description", changed_output)
+
+    def test_json_format(self):
+        self.useFixture(CleanUpModuleImport("examples.api"))
+
+        args = main.parse_args(
+            ["lint", "--format", "json", "examples/api.json", "examples.api"]
+        )
+
+        output = io.StringIO()
+        result = main.lint_cmd(args, stream=output)
+        self.assertEqual(1, result)
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(3, len(records))
+        self.assertEqual(
+            {
+                "level": "error",
+                "rule_id": "LintError/cannot-require-new-field",
+                "api_name": "foo",
+                "name": "request_schema.required",
+                "message": "Cannot require new field baz",
+                "location": {"filename": "examples/api.py", "lineno": 7},
+            },
+            records[0],
+        )
+        self.assertEqual(
+            ["warning", "warning"], [record["level"] for record in records[1:]]
+        )
+
+    def test_sarif_format(self):
+        self.useFixture(CleanUpModuleImport("examples.api"))
+
+        args = main.parse_args(
+            ["lint", "--format", "sarif", "examples/api.json", "examples.api"]
+        )
+
+        output = io.StringIO()
+        result = main.lint_cmd(args, stream=output)
+        self.assertEqual(1, result)
+        log = json.loads(output.getvalue())
+        self.assertEqual("2.1.0", log["version"])
+        results = log["runs"][0]["results"]
+        self.assertEqual(["error", "note", "note"], [r["level"] for r in results])
+        self.assertEqual(
+            "API foo at request_schema.required: Cannot require new field baz",
+            results[0]["message"]["text"],
+        )
+        self.assertEqual(
+            {
+                "physicalLocation": {
+                    "artifactLocation": {"uri": "examples/api.py"},
+                    "region": {"startLine": 23},
+                }
+            },
+            results[2]["locations"][0],
+        )
+        rules = log["runs"][0]["tool"]["driver"]["rules"]
+        self.assertEqual(
+            [
+                "LintError/cannot-require-new-field",
+                "LintWarning/missing-description-field",
+            ],
+            [rule["id"] for rule in rules],
+        )
+        self.assertEqual(
+            [rules[r["ruleIndex"]]["id"] for r in results],
+            [r["ruleId"] for r in results],
+        )
+        self.assertEqual(
+            "missing description field", rules[1]["shortDescription"]["text"]
+        )
+
+    def test_sarif_format_no_messages(self):
+        output = io.StringIO()
+        main.write_lint_sarif(iter([]), output)
+        run = json.loads(output.getvalue())["runs"][0]
+        self.assertEqual([], run["results"])
+        self.assertEqual([], run["tool"]["driver"]["rules"])
+
     def test_openapi_output(self):
         self.useFixture(CleanUpModuleImport("examples.oas_testcase"))
 
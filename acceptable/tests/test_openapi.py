@@ -198,3 +198,38 @@ class OpenApiTests(testtools.TestCase):
 
         assert list(spec["paths"].keys()) == ["/foo"]
         assert list(spec["paths"]["/foo"].keys()) == ["get", "post"]
+
+    def test_dump_serialized_of_empty_metadata(self):
+        metadata = APIMetadata()
+        current, _ = metadata.serialize()
+        details = openapi.serialize_details(metadata)
+        result = openapi.dump_serialized(current, details)
+        with open("examples/oas_empty_expected.yaml", "r") as _expected:
+            expected = _expected.readlines()
+        self.assertListEqual(expected, result.splitlines(keepends=True))
+
+    def test_dump_serialized_matches_dump(self):
+        metadata = APIMetadata()
+        # a group given as "default", the name used when there is no group
+        service = AcceptableService("service", group="default", metadata=metadata)
+        grouped = AcceptableService("service", group="things", metadata=metadata)
+        schema = {"type": "object", "properties": {"foo": {"type": "string"}}}
+        api = service.api("/foo/<id:int>", "get_foo", methods=["GET", "PUT"])
+        api.request_schema = schema
+        api.response_schema = schema
+        api.params_schema = {"type": "object", "properties": {"q": schema}}
+        grouped.api("/bar", "bar", title="Get a bar", introduced_at=3)
+        # a title given explicitly, the same as the default
+        grouped.api("/b", "get_b", title="Get B")
+
+        details = openapi.serialize_details(metadata)
+        result = openapi.dump_serialized(metadata.serialize()[0], details)
+
+        self.assertEqual(openapi.dump(metadata), result)
+        self.assertNotIn("&id", result)
+        spec = yaml.safe_load(result)
+        self.assertEqual([{"name": "default"}, {"name": "things"}], spec["tags"])
+        self.assertEqual("Get a bar", spec["paths"]["/bar"]["get"]["summary"])
+        self.assertEqual("Get B", spec["paths"]["/b"]["get"]["summary"])
+        self.assertNotIn("summary", spec["paths"]["/foo/{id}"]["get"])
+        self.assertEqual(["default"], spec["paths"]["/foo/{id}"]["get"]["tags"])
@@ -1,5 +1,6 @@
 # Copyright 2017 Canonical Ltd.  This software is licensed under the
 # GNU Lesser General Public License version 3 (see the file LICENSE).
+"""Tests for acceptable._service."""
 import json
 
 import jsonschema.exceptions
@@ -8,13 +9,19 @@ from flask import Flask
 from testtools import TestCase
 from testtools.matchers import Equals, Matcher
 
+from acceptable import _service, util
 from acceptable._service import (
     AcceptableAPI,
     AcceptableService,
     APIMetadata,
     InvalidAPI,
 )
-from acceptable._validation import DataValidationError, validate_body, validate_output
+from acceptable._validation import (
+    DataValidationError,
+    set_timing_sink,
+    validate_body,
+    validate_output,
+)
 
 
 class APIMetadataTestCase(TestCase):
@@ -58,6 +65,195 @@ class APIMetadataTestCase(TestCase):
         metadata.register_service("test", None)
         self.assertEqual({"api": api}, metadata.services["test"][None])
 
+    def test_lookups(self):
+        metadata = APIMetadata()
+        metadata.register_service("test", None)
+        api1 = AcceptableAPI(None, "api1", "/api", 1)
+        api2 = AcceptableAPI(
+            None, "api2", "/api", 2, options={"methods": ["POST", "PUT"]}
+        )
+        api3 = AcceptableAPI(None, "api3", None, 2, deprecated_at=3)
+        for api in (api1, api2, api3):
+            metadata.register_api("test", None, api)
+
+        self.assertIs(api2, metadata.get_api("api2"))
+        self.assertIsNone(metadata.get_api("missing"))
+        self.assertIs(api1, metadata.get_api_by_url("/api"))
+        self.assertIs(api2, metadata.get_api_by_url("/api", "put"))
+        self.assertIsNone(metadata.get_api_by_url("/api", "DELETE"))
+        self.assertEqual([api1], metadata.apis_introduced_at(1))
+        self.assertEqual([api2, api3], metadata.apis_introduced_at(2))
+        self.assertEqual([api3], metadata.apis_deprecated_at(3))
+        self.assertEqual([], metadata.apis_deprecated_at(1))
+
+        metadata.clear()
+        self.assertIsNone(metadata.get_api("api1"))
+        self.assertEqual([], metadata.apis_introduced_at(1))
+
+    def test_version_lookups_follow_changes(self):
+        metadata = APIMetadata()
+        metadata.register_service("test", None)
+        api = AcceptableAPI(None, "api", "/api", None)
+        metadata.register_api("test", None, api)
+
+        api.introduced_at = 2
+        api.deprecated_at = 4
+        self.assertEqual([api], metadata.apis_introduced_at(2))
+        self.assertEqual([api], metadata.apis_deprecated_at(4))
+        api.introduced_at = 3
+        self.assertEqual([], metadata.apis_introduced_at(2))
+        self.assertEqual([api], metadata.apis_introduced_at(3))
+
+    def test_url_lookups_follow_changes(self):
+        metadata = APIMetadata()
+        metadata.register_service("test", None)
+        api1 = AcceptableAPI(None, "api1", "/api", 1)
+        api2 = AcceptableAPI(None, "api2", "/api", 1, options={"methods": ["PUT"]})
+        metadata.register_api("test", None, api1)
+        metadata.register_api("test", None, api2)
+
+        api1.url = "/api1"
+        self.assertIs(api1, metadata.get_api_by_url("/api1"))
+        self.assertIsNone(metadata.get_api_by_url("/api"))
+        api2.options = {"methods": ["GET"]}
+        self.assertIs(api2, metadata.get_api_by_url("/api"))
+        self.assertIsNone(metadata.get_api_by_url("/api", "PUT"))
+
+        # an api keeps a url until it moves, then the next api takes it
+        api1.url = "/api"
+        self.assertIs(api2, metadata.get_api_by_url("/api"))
+        api2.url = "/api2"
+        self.assertIs(api1, metadata.get_api_by_url("/api"))
+
+    def test_clear_detaches_apis(self):
+        metadata = APIMetadata()
+        metadata.register_service("test", None)
+        api = AcceptableAPI(None, "api", "/api", 1)
+        metadata.register_api("test", None, api)
+        metadata.clear()
+
+        api.introduced_at = 2
+        api.url = "/other"
+        api.changelog(3, "Changed.")
+        self.assertEqual([], metadata.apis_introduced_at(2))
+        self.assertIsNone(metadata.get_api_by_url("/other"))
+        self.assertIsNone(metadata.current_version)
+
+    def test_current_version_is_kept_up_to_date(self):
+        metadata = APIMetadata()
+        metadata.register_service("test", None)
+        self.assertIsNone(metadata.current_version)
+
+        api1 = AcceptableAPI(None, "api1", "/api1", 2)
+        metadata.register_api("test", None, api1)
+        self.assertEqual(2, metadata.current_version)
+
+        api2 = AcceptableAPI(None, "api2", "/api2", None)
+        metadata.register_api("test", None, api2)
+        self.assertEqual(2, metadata.current_version)
+
+        api2.changelog(4, "Changed.")
+        self.assertEqual(4, metadata.current_version)
+        api2.introduced_at = 5
+        self.assertEqual(5, metadata.current_version)
+
+        # lowering the latest version falls back to the next latest
+        api2.introduced_at = 1
+        self.assertEqual(4, metadata.current_version)
+
+        metadata.clear()
+        self.assertIsNone(metadata.current_version)
+
+    def test_current_version_includes_existing_changelog(self):
+        metadata = APIMetadata()
+        metadata.register_service("test", None)
+        api = AcceptableAPI(None, "api", "/api", 1)
+        api.changelog(3, "Changed.")
+        metadata.register_api("test", None, api)
+        self.assertEqual(3, metadata.current_version)
+
+    def test_register_apis_with_existing_changelogs(self):
+        metadata = APIMetadata()
+        metadata.register_service("test", None)
+        for name in ("api1", "api2"):
+            api = AcceptableAPI(None, name, "/" + name, 1)
+            api.changelog(3, "Changed.")
+            metadata.register_api("test", None, api)
+
+        self.assertEqual(3, metadata.current_version)
+        self.assertEqual({3: 2}, dict(metadata._changelog_versions))
+
+    def test_serialize_caches_unchanged_apis(self):
+        metadata = APIMetadata()
+        service = AcceptableService("service", metadata=metadata)
+        api1 = service.api("/api1", "api1", introduced_at=1)
+        api2 = service.api("/api2", "api2", introduced_at=1)
+        api1.request_schema = {"type": "object"}
+
+        serialized, locations = metadata.serialize()
+        apis = serialized["default"]["apis"]
+        cached = api1._serialized
+        again, _ = metadata.serialize()
+        self.assertIs(cached, api1._serialized)
+        self.assertEqual(apis, again["default"]["apis"])
+
+        # callers get copies, which they can change
+        apis["api1"]["doc"] = "Changed."
+        locations["api1"]["view"] = "view"
+        again, again_locations = metadata.serialize()
+        self.assertIsNone(again["default"]["apis"]["api1"]["doc"])
+        self.assertIsNone(again_locations["api1"]["view"])
+
+        api1.docs = "Documentation."
+        api2.changelog(2, "Changed.")
+        api2.url = "/api2/v2"
+        again, again_locations = metadata.serialize()
+        again_apis = again["default"]["apis"]
+        self.assertIsNot(apis["api1"], again_apis["api1"])
+        self.assertEqual("Documentation.", again_apis["api1"]["doc"])
+        self.assertEqual({2: "Changed."}, again_apis["api2"]["changelog"])
+        self.assertEqual("/api2/v2", again_apis["api2"]["url"])
+        self.assertEqual(2, again["$version"])
+        self.assertEqual([2], list(again_locations["api2"]["changelog"]))
+
+    def test_serialize_sees_changes_in_place(self):
+        metadata = APIMetadata()
+        service = AcceptableService("service", metadata=metadata)
+        api = service.api("/api", "api", introduced_at=1)
+        api.request_schema = {"type": "object"}
+        api.changelog(2, "Changed.")
+        metadata.serialize()
+
+        api.options["methods"] = ["POST"]
+        api.request_schema["description"] = "Request."
+        api._changelog[3] = "Changed again."
+        serialized = metadata.serialize()[0]["default"]["apis"]["api"]
+        self.assertEqual(["POST"], serialized["methods"])
+        self.assertEqual("Request.", serialized["request_schema"]["description"])
+        self.assertEqual([2, 3], list(serialized["changelog"]))
+
+        for attr, value, key in (
+            ("title", "Title", "title"),
+            ("undocumented", True, "undocumented"),
+            ("deprecated_at", 4, "deprecated_at"),
+            ("response_schema", {"type": "array"}, "response_schema"),
+        ):
+            setattr(api, attr, value)
+            serialized = metadata.serialize()[0]["default"]["apis"]["api"]
+            self.assertEqual(value, serialized[key])
+
+    def test_check_schemas(self):
+        metadata = APIMetadata()
+        metadata.register_service("test", None)
+        api = AcceptableAPI(None, "api", "/api", 1)
+        api.request_schema = {"type": "object"}
+        metadata.register_api("test", None, api)
+        metadata.check_schemas()
+
+        # as if the schema had been set while checks were deferred
+        api._response_schema = {"required": "bar"}
+        self.assertRaises(jsonschema.exceptions.SchemaError, metadata.check_schemas)
+
     def test_bind_works(self):
         app = Flask(__name__)
         metadata = APIMetadata()
@@ -111,6 +307,23 @@ class AcceptableServiceTestCase(TestCase):
 
         self.assertThat(resp, IsResponse("test view"))
 
+    def test_works_without_locations(self):
+        util.set_capture_locations(False)
+        self.addCleanup(util.set_capture_locations, True)
+        metadata = APIMetadata()
+        service = AcceptableService("service", metadata=metadata)
+        api = service.api("/foo", "foo_api")
+
+        @api
+        def view():
+            return "test view", 200
+
+        self.assertIsNone(api.location)
+        self.assertIsNone(api.view_fn_location)
+        self.assertEqual(
+            metadata.services["service"][None].docs, util.clean_docstring(__doc__)
+        )
+
 
 class ServiceFixture(Fixture):
     """A reusable fixture that sets up several API endpoints."""
@@ -180,6 +393,44 @@ class AcceptableAPITestCase(TestCase):
         self.assertEqual(["1", "3", "5"], list(api.request_schema["properties"]))
         self.assertEqual(["1", "3", "5"], list(api.response_schema["properties"]))
 
+    def test_acceptable_api_schemas_are_sorted_lazily(self):
+        sorted_schemas = []
+
+        def sort_schema(schema):
+            sorted_schemas.append(schema)
+            return util.sort_schema(schema)
+
+        self.patch(_service, "sort_schema", sort_schema)
+        fixture = self.useFixture(ServiceFixture())
+        api = fixture.service.api("/api", "blah")
+        schema = {"type": "object"}
+        api.request_schema = schema
+        self.assertEqual([], sorted_schemas)
+
+        self.assertEqual(schema, api.request_schema)
+        self.assertIs(api.request_schema, api.request_schema)
+        self.assertEqual([schema], sorted_schemas)
+
+        # setting another schema replaces the cached one
+        api.request_schema = {"type": "array"}
+        self.assertEqual({"type": "array"}, api.request_schema)
+        self.assertEqual(2, len(sorted_schemas))
+
+    def test_acceptable_api_is_compact(self):
+        fixture = self.useFixture(ServiceFixture())
+        api = fixture.service.api("/api", "blah")
+        self.assertFalse(hasattr(api, "__dict__"))
+        self.assertFalse(hasattr(fixture.service.apis, "__dict__"))
+        fixture.metadata.serialize()
+        self.assertIsNone(api._changelog_docs)
+
+        # created on first use, and kept
+        api._changelog[3] = "Changed."
+        self.assertEqual({3: "Changed."}, api._changelog)
+        self.assertEqual({}, api._changelog_locations)
+        serialized = fixture.metadata.serialize()[0]["default"]["apis"]["blah"]
+        self.assertEqual({3: "Changed."}, serialized["changelog"])
+
     def test_acceptable_api_changelog_is_recorded(self):
         fixture = self.useFixture(ServiceFixture())
         api = fixture.service.api("/api", "blah")
@@ -233,6 +484,25 @@ class AcceptableAPITestCase(TestCase):
         with app.test_request_context("/new", **payload):
             self.assertRaises(DataValidationError, new_view)
 
+    def test_decorator_streams_request(self):
+        fixture = self.useFixture(ServiceFixture())
+
+        new_api = fixture.service.api("/new", "new", methods=["POST"])
+        new_api.request_schema = {"type": "array", "items": {"type": "integer"}}
+        new_api.request_stream = True
+        new_api.request_max_errors = 1
+
+        @new_api
+        def new_view():
+            return "new view", 200
+
+        app = fixture.bind()
+
+        payload = dict(data="[1, 2, []]", headers={"Content-Type": "application/json"})
+        with app.test_request_context("/new", **payload):
+            e = self.assertRaises(DataValidationError, new_view)
+        self.assertEqual(["[] is not of type 'integer' at /2"], e.error_list)
+
     def test_decorator_validates_bad_response(self):
         fixture = self.useFixture(ServiceFixture())
 
@@ -248,6 +518,50 @@ class AcceptableAPITestCase(TestCase):
         with app.test_request_context("/new"):
             self.assertRaises(AssertionError, new_view)
 
+    def test_decorator_samples_response_validation(self):
+        fixture = self.useFixture(ServiceFixture())
+
+        new_api = fixture.service.api("/new", "new")
+        new_api.response_schema = {"type": "object"}
+        new_api.response_sample_rate = 0.0
+
+        @new_api
+        def new_view():
+            return []
+
+        app = fixture.bind()
+
+        with app.test_request_context("/new"):
+            self.assertEqual([], new_view().json)
+
+    def test_decorator_times_validation_by_api_name(self):
+        fixture = self.useFixture(ServiceFixture())
+
+        new_api = fixture.service.api("/new", "new", methods=["POST"])
+        new_api.request_schema = {"type": "object"}
+        new_api.response_schema = {"type": "object"}
+
+        @new_api
+        def new_view():
+            return {}
+
+        app = fixture.bind()
+        timings = []
+        set_timing_sink(lambda *args: timings.append(args[:2]))
+        self.addCleanup(set_timing_sink, None)
+
+        with app.test_request_context("/new", method="POST", json={}):
+            new_view()
+        self.assertEqual(
+            [
+                ("new", "decode"),
+                ("new", "request"),
+                ("new", "response"),
+                ("new", "encode"),
+            ],
+            timings,
+        )
+
     def test_can_still_call_view_directly(self):
         fixture = self.useFixture(ServiceFixture())
 
@@ -1,5 +1,7 @@
 # Copyright 2017 Canonical Ltd.  This software is licensed under the
 # GNU Lesser General Public License version 3 (see the file LICENSE).
+import sys
+
 import testtools
 
 from acceptable import util
@@ -21,3 +23,33 @@ class UtilsTestCase(testtools.TestCase):
         self.assertEqual(["1", "3", "5"], list(srtd["foo"]["b"][0]))
         # ensure we preserve the order of lists
         self.assertEqual([5, 1, 3], list(srtd["foo"]["a"][0]))
+
+
+class CallSiteTestCase(testtools.TestCase):
+    def test_matches_location_dict(self):
+        location = util.get_callsite_location(depth=0)
+        lineno = sys._getframe().f_lineno - 1
+        self.assertEqual(
+            {"filename": __file__, "lineno": lineno, "module": sys.modules[__name__]},
+            location,
+        )
+
+    def test_resolves_lazily(self):
+        self.patch(util.inspect, "getsourcefile", lambda obj: "resolved.py")
+        location = util.get_callsite_location(depth=0)
+        self.assertIs(util._UNRESOLVED, location._filename)
+        self.assertIs(util._UNRESOLVED, location._module)
+        self.assertEqual("resolved.py", location["filename"])
+        self.assertIs(sys.modules[__name__], location["module"])
+
+    def test_lineno_can_be_adjusted(self):
+        location = util.get_callsite_location(depth=0)
+        lineno = location["lineno"]
+        location["lineno"] += 1
+        self.assertEqual(lineno + 1, location["lineno"])
+        self.assertRaises(KeyError, location.__setitem__, "other", 1)
+
+    def test_capture_can_be_disabled(self):
+        util.set_capture_locations(False)
+        self.addCleanup(util.set_capture_locations, True)
+        self.assertIsNone(util.get_callsite_location())
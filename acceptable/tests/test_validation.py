@@ -1,14 +1,33 @@
 # Copyright 2017 Canonical Ltd.  This software is licensed under the
 # GNU Lesser General Public License version 3 (see the file LICENSE).
+import asyncio
+import dataclasses
+import datetime
+import decimal
+import io
 import json
+import threading
 
 import flask
 import jsonschema
-from fixtures import Fixture
-from testtools import TestCase
+from fixtures import FakeLogger, Fixture
+from testtools import TestCase, skipIf
 from testtools.matchers import StartsWith
 
-from acceptable._validation import DataValidationError, validate_body, validate_output
+from acceptable import _validation
+from acceptable._validation import (
+    BackgroundValidator,
+    DataValidationError,
+    HistogramTimingSink,
+    ValidatorCache,
+    log_output_violation,
+    set_timing_sink,
+    validate,
+    validate_body,
+    validate_output,
+    validate_params,
+    validator_cache,
+)
 
 
 class FlaskValidateBodyFixture(Fixture):
@@ -84,6 +103,119 @@ class ValidateBodyTests(TestCase):
             e.error_list[0], StartsWith("Error decoding JSON request body: ")
         )
 
+    def test_invalid_json_is_decoded_once(self):
+        app = self.useFixture(FlaskValidateBodyFixture({"type": "object"}))
+        calls = []
+
+        def loads(*args, **kwargs):
+            calls.append(args)
+            return json_loads(*args, **kwargs)
+
+        json_loads = json.loads
+        self.patch(json, "loads", loads)
+        self.assertRaises(
+            DataValidationError,
+            app.client.post,
+            "/",
+            data="invalid json",
+            headers={"Content-Type": "application/json"},
+        )
+        self.assertEqual(1, len(calls))
+
+    def test_payload_available_to_view(self):
+        seen = []
+
+        def view():
+            seen.append(flask.request.get_json())
+            return "OK", 200
+
+        app = self.useFixture(
+            FlaskValidateBodyFixture({"type": "object"}, view_fn=view)
+        )
+        app.post_json({"foo": "bar"})
+        self.assertEqual([{"foo": "bar"}], seen)
+
+    def test_uses_app_json_provider(self):
+        seen = []
+
+        class DecimalJSONProvider(flask.json.provider.DefaultJSONProvider):
+            def loads(self, s, **kwargs):
+                return super().loads(s, parse_float=decimal.Decimal, **kwargs)
+
+        def view():
+            seen.append(flask.request.get_json())
+            return "OK", 200
+
+        schema = {"type": "object", "properties": {"price": {"type": "number"}}}
+        app = self.useFixture(FlaskValidateBodyFixture(schema, view_fn=view))
+        app.app.json = DecimalJSONProvider(app.app)
+
+        self.assertEqual(200, app.post_json({"price": 1.1}).status_code)
+        self.assertEqual([{"price": decimal.Decimal("1.1")}], seen)
+        self.assertIsInstance(seen[0]["price"], decimal.Decimal)
+
+    def test_raises_on_body_too_large(self):
+        app = self.useFixture(FlaskValidateBodyFixture({"type": "object"}))
+        app.app.config["ACCEPTABLE_MAX_BODY_SIZE"] = 10
+
+        self.assertEqual(200, app.post_json({"a": 1}).status_code)
+        e = self.assertRaises(DataValidationError, app.post_json, {"a": "b" * 10})
+        self.assertEqual(
+            ["Request body too large: 19 bytes, maximum is 10"], e.error_list
+        )
+
+    def test_raises_on_body_too_large_without_content_length(self):
+        app = self.useFixture(FlaskValidateBodyFixture({"type": "object"}))
+        app.app.config["ACCEPTABLE_MAX_BODY_SIZE"] = 10
+
+        e = self.assertRaises(
+            DataValidationError,
+            app.client.post,
+            "/",
+            input_stream=io.BytesIO(b'{"a": "bbbbbbbbbb"}'),
+            environ_overrides={"wsgi.input_terminated": True, "CONTENT_LENGTH": ""},
+        )
+        self.assertEqual(
+            ["Request body too large: at least 11 bytes, maximum is 10"], e.error_list
+        )
+
+    def test_reads_at_most_max_body_size_without_content_length(self):
+        app = self.useFixture(FlaskValidateBodyFixture({"type": "array"}))
+        app.app.config["ACCEPTABLE_MAX_BODY_SIZE"] = 10
+        stream = io.BytesIO(b"[" + b"1," * 1000000 + b"1]")
+
+        e = self.assertRaises(
+            DataValidationError,
+            app.client.post,
+            "/",
+            input_stream=stream,
+            environ_overrides={"wsgi.input_terminated": True, "CONTENT_LENGTH": ""},
+        )
+        self.assertEqual(
+            ["Request body too large: at least 11 bytes, maximum is 10"], e.error_list
+        )
+        self.assertEqual(11, stream.tell())
+
+    def test_payload_available_to_view_without_content_length(self):
+        seen = []
+
+        def view():
+            seen.append(flask.request.get_json())
+            return "OK", 200
+
+        app = self.useFixture(
+            FlaskValidateBodyFixture({"type": "object"}, view_fn=view)
+        )
+        app.app.config["ACCEPTABLE_MAX_BODY_SIZE"] = 10
+        resp = app.client.post(
+            "/",
+            input_stream=io.BytesIO(b'{"a": 1}'),
+            content_type="application/json",
+            environ_overrides={"wsgi.input_terminated": True, "CONTENT_LENGTH": ""},
+        )
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual([{"a": 1}], seen)
+
     def test_validates_even__on_wrong_mimetype(self):
         app = self.useFixture(FlaskValidateBodyFixture({"type": "object"}))
 
@@ -97,6 +229,154 @@ class ValidateBodyTests(TestCase):
         self.assertEqual(200, resp.status_code)
 
 
+class StreamingValidateBodyTests(TestCase):
+    schema = {
+        "type": "array",
+        "items": {"type": "object", "required": ["id"]},
+        "maxItems": 3,
+    }
+
+    def post(self, data, schema=None, **kwargs):
+        app = flask.Flask(__name__)
+        app.testing = True
+        seen = []
+
+        kwargs.setdefault("stream", True)
+
+        @app.route("/", methods=["POST"])
+        @validate_body(schema or self.schema, **kwargs)
+        def view():
+            seen.append(flask.request.get_json(silent=True))
+            return "OK", 200
+
+        resp = app.test_client().post(
+            "/", data=data, headers={"Content-Type": "application/json"}
+        )
+        return resp, seen
+
+    def test_requires_array_schema(self):
+        self.assertRaises(
+            ValueError, validate_body({"type": "object"}, stream=True), lambda: None
+        )
+
+    def test_passes_parsed_payload_to_view(self):
+        resp, seen = self.post('[{"id": 1}, {"id": 2, "x": [1, 2]}]')
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual([[{"id": 1}, {"id": 2, "x": [1, 2]}]], seen)
+
+    def test_reports_item_errors_with_index(self):
+        e = self.assertRaises(DataValidationError, self.post, '[{"id": 1}, {}, []]')
+        self.assertEqual(
+            ["'id' is a required property at /1", "[] is not of type 'object' at /2"],
+            e.error_list,
+        )
+
+    def test_validates_array_keywords(self):
+        e = self.assertRaises(DataValidationError, self.post, "[{}, {}, {}, {}]")
+        self.assertEqual(5, len(e.error_list))
+        self.assertIn("is too long at /", e.error_list[-1])
+
+    def test_passes_items_to_callable_without_keeping_them(self):
+        items = []
+        schema = {"type": "array", "items": self.schema["items"]}
+        resp, seen = self.post('[{"id": 1}, {"id": 2}]', schema, stream=items.append)
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual([{"id": 1}, {"id": 2}], items)
+        self.assertEqual([None], seen)
+
+    def test_callable_only_gets_valid_items(self):
+        items = []
+        schema = {"type": "array", "items": self.schema["items"]}
+        e = self.assertRaises(
+            DataValidationError,
+            self.post,
+            '[{"id": 1}, {}]',
+            schema,
+            stream=items.append,
+        )
+        self.assertEqual(["'id' is a required property at /1"], e.error_list)
+        self.assertEqual([{"id": 1}], items)
+
+        e = self.assertRaises(
+            DataValidationError, self.post, "null", schema, stream=items.append
+        )
+        self.assertEqual(["None is not of type 'array' at /"], e.error_list)
+
+    def test_callable_rejects_array_keywords(self):
+        e = self.assertRaises(
+            ValueError, validate_body(self.schema, stream=print), lambda: None
+        )
+        self.assertIn("maxItems", str(e))
+
+    def test_stops_at_max_errors(self):
+        e = self.assertRaises(
+            DataValidationError, self.post, "[{}, {}, {}, not json", max_errors=2
+        )
+        self.assertEqual(
+            ["'id' is a required property at /0", "'id' is a required property at /1"],
+            e.error_list,
+        )
+
+    def test_reads_body_in_chunks(self):
+        self.patch(_validation, "STREAM_CHUNK_SIZE", 4)
+        items = [{"id": i, "name": "x" * i * 5} for i in range(3)]
+        resp, seen = self.post(json.dumps(items))
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual([items], seen)
+
+    def test_not_an_array(self):
+        e = self.assertRaises(DataValidationError, self.post, '{"id": 1}')
+        self.assertEqual(["{'id': 1} is not of type 'array' at /"], e.error_list)
+
+    def test_invalid_json(self):
+        e = self.assertRaises(DataValidationError, self.post, '[{"id": 1} {}]')
+        self.assertThat(
+            e.error_list[0], StartsWith("Error decoding JSON request body: ")
+        )
+
+    def test_invalid_json_position_is_in_whole_body(self):
+        self.patch(_validation, "STREAM_CHUNK_SIZE", 4)
+        for body in ['[{"id": 1},\n {"id": 2} {}]', '[{"id": 1},\n {"id": 2}, {x}]']:
+            try:
+                json.loads(body)
+            except ValueError as e:
+                expected = "Error decoding JSON request body: %s" % e
+            e = self.assertRaises(DataValidationError, self.post, body)
+            self.assertEqual([expected], e.error_list)
+
+    def test_stops_reading_at_malformed_item(self):
+        data = '[{"id": 1}, {"id": x}, ' + '{"id": 2}, ' * 1000 + "{}]"
+        stream = io.BytesIO(data.encode())
+        reader = _validation._JSONArrayReader(stream, "utf-8", chunk_size=16)
+        with flask.Flask(__name__).app_context():
+            e = self.assertRaises(json.JSONDecodeError, list, reader)
+        self.assertEqual("Expecting value", e.msg)
+        self.assertEqual(data.index("x"), e.pos)
+        self.assertLess(stream.tell(), 100)
+
+    def test_body_already_read(self):
+        app = flask.Flask(__name__)
+        app.testing = True
+        seen = []
+
+        @app.before_request
+        def read_body():
+            flask.request.get_data()
+
+        @app.route("/", methods=["POST"])
+        @validate_body(self.schema, stream=True)
+        def view():
+            seen.append(flask.request.get_json())
+            return "OK", 200
+
+        client = app.test_client()
+        resp = client.post("/", json=[{"id": 1}])
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual([[{"id": 1}]], seen)
+        e = self.assertRaises(DataValidationError, client.post, "/", json=[{}])
+        self.assertEqual(["'id' is a required property at /0"], e.error_list)
+
+
 class ValidateOutputTests(TestCase):
     def test_raises_on_bad_schema(self):
         def fn():
@@ -152,6 +432,209 @@ class ValidateOutputTests(TestCase):
         app.app.config["ACCEPTABLE_VALIDATE_OUTPUT"] = True
         self.assertRaises(AssertionError, app.post_json, [])
 
+    def test_samples_validation(self):
+        def view():
+            return []
+
+        app = self.useFixture(
+            FlaskValidateBodyFixture(output_schema={"type": "object"}, view_fn=view)
+        )
+
+        app.app.config["ACCEPTABLE_VALIDATE_OUTPUT_SAMPLE_RATE"] = 0.0
+        self.assertEqual(b"[]\n", app.post_json([]).data)
+
+        app.app.config["ACCEPTABLE_VALIDATE_OUTPUT_SAMPLE_RATE"] = 0.5
+        self.patch(_validation.random, "random", lambda: 0.75)
+        self.assertEqual(b"[]\n", app.post_json([]).data)
+        self.patch(_validation.random, "random", lambda: 0.25)
+        self.assertRaises(AssertionError, app.post_json, [])
+
+    def test_sample_rate_overrides_config(self):
+        app = flask.Flask(__name__)
+        app.testing = True
+        app.config["ACCEPTABLE_VALIDATE_OUTPUT_SAMPLE_RATE"] = 0.0
+
+        @app.route("/")
+        @validate_output({"type": "object"}, sample_rate=1.0)
+        def view():
+            return []
+
+        self.assertRaises(AssertionError, app.test_client().get, "/")
+
+    def test_violation_handler(self):
+        def view():
+            return []
+
+        app = self.useFixture(
+            FlaskValidateBodyFixture(output_schema={"type": "object"}, view_fn=view)
+        )
+        violations = []
+        app.app.config["ACCEPTABLE_OUTPUT_VIOLATION_HANDLER"] = lambda *args: (
+            violations.append(args)
+        )
+
+        self.assertEqual(b"[]\n", app.post_json([]).data)
+        self.assertEqual(
+            [("view", ["[] is not of type 'object' at /"], [])], violations
+        )
+
+    def test_log_output_violation(self):
+        def view():
+            return []
+
+        app = self.useFixture(
+            FlaskValidateBodyFixture(output_schema={"type": "object"}, view_fn=view)
+        )
+        app.app.config["ACCEPTABLE_OUTPUT_VIOLATION_HANDLER"] = log_output_violation
+        logger = self.useFixture(FakeLogger("acceptable"))
+
+        self.assertEqual(b"[]\n", app.post_json([]).data)
+        self.assertEqual(
+            "Response from view does not comply with output schema: "
+            "[\"[] is not of type 'object' at /\"]\n",
+            logger.output,
+        )
+
+    def test_background_validation(self):
+        def view():
+            return []
+
+        app = self.useFixture(
+            FlaskValidateBodyFixture(output_schema={"type": "object"}, view_fn=view)
+        )
+        violations = []
+        background = BackgroundValidator(lambda *args: violations.append(args))
+        app.app.config["ACCEPTABLE_BACKGROUND_VALIDATOR"] = background
+
+        self.assertEqual(b"[]\n", app.post_json([]).data)
+        background.shutdown()
+        self.assertEqual(
+            [("view", ["[] is not of type 'object' at /"], [])], violations
+        )
+        self.assertEqual((1, 0), (background.submitted, background.dropped))
+
+    def test_background_validation_of_changed_response(self):
+        shared = {"a": 1}
+
+        def view():
+            return shared
+
+        schema = {"type": "object", "properties": {"a": {"type": "integer"}}}
+        app = self.useFixture(
+            FlaskValidateBodyFixture(output_schema=schema, view_fn=view)
+        )
+        violations = []
+        background = BackgroundValidator(lambda *args: violations.append(args))
+        app.app.config["ACCEPTABLE_BACKGROUND_VALIDATOR"] = background
+
+        @app.app.after_request
+        def change_response(response):
+            shared["a"] = "changed"
+            return response
+
+        # hold up the worker until the response has changed
+        release = threading.Event()
+        background.submit(lambda response: release.wait() and [], "other", b"1")
+        self.assertEqual(b'{"a":1}\n', app.post_json([]).data)
+        release.set()
+        background.shutdown()
+        self.assertEqual([], violations)
+        self.assertEqual((2, 0), (background.submitted, background.dropped))
+
+    def test_custom_json_encoder(self):
+        def view():
+            return {"b": 1, "a": [1, 2]}, 201
+
+        app = self.useFixture(
+            FlaskValidateBodyFixture(output_schema={"type": "object"}, view_fn=view)
+        )
+        app.app.config["ACCEPTABLE_JSON_ENCODER"] = lambda payload: "encoded"
+
+        resp = app.post_json({})
+        self.assertEqual(201, resp.status_code)
+        self.assertEqual("application/json", resp.mimetype)
+        self.assertEqual(b"encoded", resp.data)
+
+    def test_fast_json_encoder(self):
+        def view():
+            return {"b": 1, "a": [1, "\u00e9"]}
+
+        app = self.useFixture(
+            FlaskValidateBodyFixture(output_schema={"type": "object"}, view_fn=view)
+        )
+        app.app.config["ACCEPTABLE_JSON_ENCODER"] = "auto"
+
+        resp = app.post_json({})
+        self.assertEqual("application/json", resp.mimetype)
+        self.assertResponseJsonEqual(resp, {"a": [1, "\u00e9"], "b": 1})
+
+    @skipIf(_validation.orjson is None, "orjson not installed")
+    def test_fast_json_encoder_is_default_with_orjson(self):
+        def view():
+            return {"a": "\u00e9"}
+
+        app = self.useFixture(
+            FlaskValidateBodyFixture(output_schema={"type": "object"}, view_fn=view)
+        )
+        # orjson does not escape non-ASCII characters, jsonify() does
+        self.assertEqual('{"a":"\u00e9"}\n'.encode(), app.post_json({}).data)
+
+        app.app.debug = True
+        self.assertEqual(b'{\n  "a": "\\u00e9"\n}\n', app.post_json({}).data)
+
+        app.app.debug = False
+        app.app.config["ACCEPTABLE_JSON_ENCODER"] = None
+        self.assertEqual(b'{"a":"\\u00e9"}\n', app.post_json({}).data)
+
+    def test_jsonify_is_default_without_orjson(self):
+        def view():
+            return {"a": "\u00e9"}
+
+        app = self.useFixture(
+            FlaskValidateBodyFixture(output_schema={"type": "object"}, view_fn=view)
+        )
+        self.patch(_validation, "orjson", None)
+        self.assertEqual(b'{"a":"\\u00e9"}\n', app.post_json({}).data)
+
+    def test_fast_json_encoder_without_orjson(self):
+        self.patch(_validation, "orjson", None)
+        self.assertEqual(
+            '{"a":1,"b":[]}\n', _validation.fast_json_dumps({"b": [], "a": 1})
+        )
+
+    def test_fast_json_encoder_matches_jsonify(self):
+        @dataclasses.dataclass
+        class Point:
+            x: int
+
+        payload = {
+            "date": datetime.date(2024, 1, 2),
+            "datetime": datetime.datetime(2024, 1, 2, 3, 4, 5),
+            "decimal": decimal.Decimal("1.10"),
+            "point": Point(1),
+        }
+        app = flask.Flask(__name__)
+        with app.app_context():
+            expected = json.loads(flask.jsonify(payload).data)
+            with_orjson = _validation.fast_json_dumps(payload)
+            self.patch(_validation, "orjson", None)
+            without_orjson = _validation.fast_json_dumps(payload)
+        self.assertEqual("Tue, 02 Jan 2024 00:00:00 GMT", expected["date"])
+        self.assertEqual(expected, json.loads(with_orjson))
+        self.assertEqual(expected, json.loads(without_orjson))
+
+    def test_json_encoder_falls_back_to_jsonify(self):
+        def view():
+            return {"when": datetime.date(2024, 1, 2)}
+
+        app = self.useFixture(
+            FlaskValidateBodyFixture(output_schema={"type": "object"}, view_fn=view)
+        )
+        app.app.config["ACCEPTABLE_JSON_ENCODER"] = json.dumps
+
+        resp = app.post_json({})
+        self.assertResponseJsonEqual(resp, {"when": "Tue, 02 Jan 2024 00:00:00 GMT"})
+
     def assertResponseJsonEqual(self, response, expected_json):
         charset = response.mimetype_params.get("charset", "utf-8")
         data = json.loads(response.data.decode(charset))
@@ -198,8 +681,303 @@ class ValidateOutputTests(TestCase):
         self.assertEqual("Foo", resp.headers["Custom-Header"])
 
 
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.app = flask.Flask(__name__)
+        self.app.testing = True
+
+    def call(self, view, **kwargs):
+        with self.app.test_request_context("/", method="POST", **kwargs):
+            return asyncio.run(view())
+
+    def test_validates_request_body(self):
+        @validate_body({"type": "object", "required": ["foo"]})
+        async def view():
+            return "OK"
+
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+        self.assertEqual("OK", self.call(view, json={"foo": 1}))
+        e = self.assertRaises(DataValidationError, self.call, view, json={})
+        self.assertEqual(["'foo' is a required property at /"], e.error_list)
+
+    def test_validates_request_params(self):
+        @validate_params({"type": "object", "required": ["foo"]})
+        async def view():
+            return "OK"
+
+        self.assertEqual("OK", self.call(view, query_string={"foo": "1"}))
+        self.assertRaises(DataValidationError, self.call, view)
+
+    def test_validates_response(self):
+        @validate_output({"type": "object"})
+        async def view():
+            return flask.request.json, 201
+
+        response, status = self.call(view, json={"foo": 1})
+        self.assertEqual((b'{"foo":1}\n', 201), (response.data, status))
+        self.assertRaises(AssertionError, self.call, view, json=[])
+
+    def test_validates_in_executor(self):
+        threads = []
+
+        def check(payload):
+            threads.append(threading.current_thread())
+            return validate(payload, {"type": "object"})
+
+        self.patch(_validation, "get_checker", lambda schema, compiled: check)
+        self.app.config["ACCEPTABLE_VALIDATE_IN_EXECUTOR"] = True
+
+        @validate_body({"type": "object"})
+        @validate_output({"type": "object"})
+        async def view():
+            return flask.request.json
+
+        response = self.call(view, json={"foo": 1})
+        self.assertEqual(b'{"foo":1}\n', response.data)
+        self.assertEqual(2, len(threads))
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertRaises(DataValidationError, self.call, view, json=[])
+
+
+class TimingTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.app = flask.Flask(__name__)
+        self.app.testing = True
+        self.timings = []
+        set_timing_sink(self.record)
+        self.addCleanup(set_timing_sink, None)
+
+    def record(self, name, phase, seconds):
+        self.assertGreaterEqual(seconds, 0)
+        self.timings.append((name, phase))
+
+    def test_times_request_and_response(self):
+        @validate_params({"type": "object"})
+        @validate_body({"type": "object"})
+        @validate_output({"type": "object"})
+        def view():
+            return {}
+
+        with self.app.test_request_context("/", method="POST", json={}):
+            view()
+        self.assertEqual(
+            [
+                ("view", "params"),
+                ("view", "decode"),
+                ("view", "request"),
+                ("view", "response"),
+                ("view", "encode"),
+            ],
+            self.timings,
+        )
+
+    def test_times_streamed_request_as_one_phase(self):
+        @validate_body({"type": "array", "items": {"type": "integer"}}, stream=True)
+        def view():
+            return "OK"
+
+        with self.app.test_request_context("/", method="POST", json=[1, 2]):
+            view()
+        self.assertEqual([("view", "request")], self.timings)
+
+    def test_times_invalid_requests(self):
+        @validate_body({"type": "object"})
+        def view():
+            return "OK"
+
+        with self.app.test_request_context("/", method="POST", json=[]):
+            self.assertRaises(DataValidationError, view)
+        self.assertEqual([("view", "decode"), ("view", "request")], self.timings)
+
+    def test_no_timer_without_sink(self):
+        set_timing_sink(None)
+        self.assertIsNone(_validation._start_timer("view"))
+
+    def test_histogram_sink(self):
+        observed = []
+
+        class Histogram:
+            def labels(self, **labels):
+                return self
+
+            def observe(self, value):
+                observed.append(value)
+
+        HistogramTimingSink(Histogram())("view", "request", 0.5)
+        self.assertEqual([0.5], observed)
+
+
+class BackgroundValidatorTests(TestCase):
+    def test_drops_work_when_full(self):
+        release = threading.Event()
+        checked = []
+
+        def check(response):
+            release.wait()
+            checked.append(response)
+            return []
+
+        background = BackgroundValidator(max_pending=1)
+        self.assertTrue(background.submit(check, "view", b"1"))
+        self.assertFalse(background.submit(check, "view", b"2"))
+        release.set()
+        background.shutdown()
+
+        self.assertEqual([1], checked)
+        self.assertEqual((1, 1), (background.submitted, background.dropped))
+
+    def test_drops_responses_after_shutdown(self):
+        def view():
+            return []
+
+        app = self.useFixture(
+            FlaskValidateBodyFixture(output_schema={"type": "object"}, view_fn=view)
+        )
+        background = BackgroundValidator()
+        app.app.config["ACCEPTABLE_BACKGROUND_VALIDATOR"] = background
+        background.shutdown()
+
+        self.assertEqual(200, app.post_json([]).status_code)
+        self.assertFalse(background.submit(lambda response: [], "view", b"1"))
+        self.assertEqual((0, 2), (background.submitted, background.dropped))
+
+    def test_logs_errors(self):
+        def check(response):
+            raise RuntimeError("boom")
+
+        logger = self.useFixture(FakeLogger("acceptable"))
+        background = BackgroundValidator()
+        background.submit(check, "view", b"{}")
+        background.shutdown()
+        self.assertIn("Error validating response from view", logger.output)
+
+
+class DeferredSchemaCheckTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.checked = []
+        check_schema = jsonschema.Draft4Validator.check_schema
+
+        def record_check(cls, schema):
+            self.checked.append(schema)
+            check_schema(schema)
+
+        self.patch(
+            jsonschema.Draft4Validator, "check_schema", classmethod(record_check)
+        )
+        self.patch(_validation, "_checked_schemas", set())
+        self.patch(_validation, "_pending_schemas", _validation.OrderedDict())
+
+    def defer(self):
+        _validation.set_defer_schema_checks(True)
+        self.addCleanup(_validation.set_defer_schema_checks, False)
+
+    def test_checks_immediately_by_default(self):
+        validate_body({"type": "object"})(lambda: None)
+        self.assertEqual([{"type": "object"}], self.checked)
+
+    def test_checks_each_schema_content_once(self):
+        _validation.validate_schema({"type": "object", "required": ["a"]})
+        _validation.validate_schema({"required": ["a"], "type": "object"})
+        _validation.validate_schema({"type": "array"})
+        self.assertEqual(2, len(self.checked))
+
+    def test_checks_tuples_and_lists_separately(self):
+        _validation.validate_schema({"required": ["a"]})
+        # jsonschema only accepts a list here
+        self.assertRaises(
+            jsonschema.SchemaError, _validation.validate_schema, {"required": ("a",)}
+        )
+        _validation.validate_schema({"properties": {"1": {}}})
+        _validation.validate_schema({"properties": {1: {}}})
+        self.assertEqual(4, len(self.checked))
+
+    def test_deferred_checks(self):
+        self.defer()
+        validate_body({"type": "object"})(lambda: None)
+        validate_output({"type": "array"})(lambda: None)
+        self.assertEqual([], self.checked)
+
+        _validation.check_schemas()
+        self.assertEqual([{"type": "object"}, {"type": "array"}], self.checked)
+        _validation.check_schemas()
+        self.assertEqual(2, len(self.checked))
+
+    def test_deferred_checks_are_bounded(self):
+        self.defer()
+        self.patch(_validation, "MAX_PENDING_SCHEMAS", 3)
+        schema = {"type": "object"}
+        for _ in range(3):
+            validate_body(schema)(lambda: None)
+        validate_body({"type": "array"})(lambda: None)
+        # the same schema is only queued once
+        self.assertEqual([], self.checked)
+
+        validate_body({"type": "string"})(lambda: None)
+        self.assertEqual(
+            [{"type": "object"}, {"type": "array"}, {"type": "string"}], self.checked
+        )
+        self.assertEqual(0, len(_validation._pending_schemas))
+
+    def test_deferred_invalid_schema(self):
+        self.defer()
+        validate_body({"required": "bar"})(lambda: None)
+        self.assertRaises(jsonschema.SchemaError, _validation.check_schemas)
+
+
 class DeltaValidationErrorTests(TestCase):
     def test_repr_and_str(self):
         e = DataValidationError(["error one", "error two"])
         self.assertEqual("DataValidationError: error one, error two", str(e))
         self.assertEqual(str(e), repr(e))
+
+
+class ValidatorCacheTests(TestCase):
+    def test_caches_on_schema_identity(self):
+        cache = ValidatorCache()
+        schema = {"type": "object"}
+
+        validator = cache.get(schema)
+        self.assertIs(validator, cache.get(schema))
+        self.assertIsNot(validator, cache.get({"type": "object"}))
+        self.assertEqual((1, 2, 1024, 2), cache.cache_info())
+
+    def test_evicts_least_recently_used(self):
+        cache = ValidatorCache(maxsize=2)
+        schema1 = {"type": "object"}
+        schema2 = {"type": "array"}
+        schema3 = {"type": "string"}
+
+        cache.get(schema1)
+        cache.get(schema2)
+        cache.get(schema1)
+        cache.get(schema3)
+
+        self.assertEqual(2, cache.cache_info().currsize)
+        cache.get(schema1)
+        self.assertEqual(2, cache.hits)
+        cache.get(schema2)
+        self.assertEqual(4, cache.misses)
+
+    def test_clear(self):
+        cache = ValidatorCache()
+        cache.get({"type": "object"})
+        cache.clear()
+        self.assertEqual((0, 0, 1024, 0), cache.cache_info())
+
+    def test_validate_uses_cache(self):
+        schema = {"type": "object"}
+        validate({}, schema)
+        hits = validator_cache.hits
+        self.assertEqual(["[] is not of type 'object' at /"], validate([], schema))
+        self.assertEqual(hits + 1, validator_cache.hits)
+
+    def test_validator_built_when_view_is_wrapped(self):
+        app = self.useFixture(FlaskValidateBodyFixture({"type": "object"}))
+        misses = validator_cache.misses
+
+        app.post_json({})
+        app.post_json({})
+        self.assertEqual(misses, validator_cache.misses)
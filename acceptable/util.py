@@ -1,18 +1,94 @@
 import difflib
 import inspect
+import os
 import pprint
 import sys
 import textwrap
 from collections import OrderedDict
+from collections.abc import MutableMapping
+
+_UNRESOLVED = object()
+
+
+class CallSite(MutableMapping):
+    """The location of a call, with 'filename', 'lineno' and 'module' keys.
+
+    Only the code object and line number are recorded when the call is made.
+    The filename and module are looked up the first time they are needed, as
+    inspect.getmodule() has to scan sys.modules.
+    """
+
+    __slots__ = ("code", "lineno", "_globals", "_filename", "_module")
+
+    _keys = ("filename", "lineno", "module")
+
+    def __init__(self, frame):
+        self.code = frame.f_code
+        self.lineno = frame.f_lineno
+        self._globals = frame.f_globals
+        self._filename = _UNRESOLVED
+        self._module = _UNRESOLVED
+
+    @property
+    def filename(self):
+        if self._filename is _UNRESOLVED:
+            self._filename = inspect.getsourcefile(self.code)
+        return self._filename
+
+    @property
+    def module(self):
+        if self._module is _UNRESOLVED:
+            module = sys.modules.get(self._globals.get("__name__"))
+            if module is None or vars(module) is not self._globals:
+                module = inspect.getmodule(self.code)
+            self._module = module
+        return self._module
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key == "lineno":
+            self.lineno = value
+        elif key in self._keys:
+            setattr(self, "_" + key, value)
+        else:
+            raise KeyError(key)
+
+    def __delitem__(self, key):
+        raise TypeError("CallSite keys cannot be deleted")
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+_capture_locations = os.environ.get("ACCEPTABLE_CAPTURE_LOCATIONS", "1") != "0"
+
+
+def set_capture_locations(enabled):
+    """Enable or disable recording where apis and schemas are defined.
+
+    Locations are only used by the lint and metadata tools, so services can
+    disable them in production, either with this function or by setting the
+    ACCEPTABLE_CAPTURE_LOCATIONS environment variable to 0. When disabled,
+    get_callsite_location() returns None.
+    """
+    global _capture_locations
+    _capture_locations = enabled
 
 
 def get_callsite_location(depth=1):
-    frame = sys._getframe(depth + 1)
-    return {
-        "filename": inspect.getsourcefile(frame),
-        "lineno": frame.f_lineno,
-        "module": inspect.getmodule(frame),
-    }
+    if not _capture_locations:
+        return None
+    return CallSite(sys._getframe(depth + 1))
 
 
 def clean_docstring(docstring):
@@ -0,0 +1,77 @@
+# Copyright 2024 Canonical Ltd.  This software is licensed under the
+# GNU Lesser General Public License version 3 (see the file LICENSE).
+"""Time compiled validation of valid array payloads.
+
+Compiled validators check a payload with the generated `_valid<n>` functions
+before collecting detailed errors with the `_check<n>` ones. "errors only"
+calls the root `_check<n>` function directly, as validators did before the
+boolean pass was added. Draft4Validator is shown for reference.
+
+Run with: python benchmarks/bench_compiled_validation.py
+"""
+import timeit
+
+from acceptable._compiler import compile_schema
+from acceptable._validation import get_checker
+
+SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "id": {"type": "integer"},
+            "name": {"type": "string"},
+            "tags": {"type": "array", "items": {"type": "string"}},
+            "score": {"type": "number"},
+            "ok": {"type": "boolean"},
+        },
+        "required": ["id", "name"],
+        "additionalProperties": False,
+    },
+}
+
+
+def make_payload(size):
+    return [
+        {"id": i, "name": "n%d" % i, "tags": ["a", "b"], "score": i * 0.5, "ok": True}
+        for i in range(size)
+    ]
+
+
+def errors_only(validate):
+    """Return the error collecting pass of a compiled `validate` function."""
+    namespace = validate.__globals__
+    # subschemas are compiled first, so the root has the highest number
+    root = max(int(name[6:]) for name in namespace if name.startswith("_check"))
+    check = namespace["_check%d" % root]
+
+    def validate_errors_only(instance):
+        errors = []
+        check(instance, None, errors)
+        return errors
+
+    return validate_errors_only
+
+
+def main():
+    validate = compile_schema(SCHEMA)
+    cases = [
+        ("compiled", validate),
+        ("compiled, errors only", errors_only(validate)),
+        ("Draft4Validator", get_checker(SCHEMA)),
+    ]
+    for size in (1, 100, 10000):
+        payload = make_payload(size)
+        number = max(1, 100000 // size)
+        for name, fn in cases:
+            assert fn(payload) == []
+            best = min(timeit.repeat(lambda: fn(payload), number=number, repeat=5))
+            print(
+                "{:>6} items  {:<24} {:10.1f}us".format(
+                    size, name, best / number * 1000000
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
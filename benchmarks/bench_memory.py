@@ -0,0 +1,47 @@
+# Copyright 2024 Canonical Ltd.  This software is licensed under the
+# GNU Lesser General Public License version 3 (see the file LICENSE).
+"""Measure the memory used by the metadata of 10k synthetic apis.
+
+The apis are in 100 groups, and 1 in 10 has a changelog entry. Locations
+are not captured, so only the api representation is measured. Run it in
+two checkouts to compare their representations.
+
+Run with: python benchmarks/bench_memory.py
+"""
+import gc
+import tracemalloc
+
+from acceptable import util
+from acceptable._service import AcceptableService, APIMetadata
+
+
+def make_metadata(groups=100, apis_per_group=100):
+    metadata = APIMetadata()
+    for group in range(groups):
+        service = AcceptableService("service", "g%d" % group, metadata=metadata)
+        for i in range(apis_per_group):
+            name = "api%d_%d" % (group, i)
+            api = service.api("/" + name, name, introduced_at=1)
+            if i % 10 == 0:
+                api.changelog(2, "Changed.")
+    return metadata
+
+
+def main():
+    util.set_capture_locations(False)
+    gc.collect()
+    tracemalloc.start()
+    metadata = make_metadata()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = len(metadata.api_names)
+    print(
+        "{} apis: {:.2f} MiB ({} bytes/api)".format(
+            count, size / 1024 / 1024, size // count
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Copyright 2024 Canonical Ltd.  This software is licensed under the
+# GNU Lesser General Public License version 3 (see the file LICENSE).
+"""Time validating and encoding a large response, as wrap_response does.
+
+"single walk" is a hand-inlined function that type checks and encodes each
+node in the same pass, as generated code would at best. It is compared with
+the compiled validator followed by each encoder.
+
+Run with: python benchmarks/bench_response_encoding.py
+"""
+import json
+import timeit
+from json.encoder import encode_basestring_ascii
+
+import flask
+
+from acceptable._validation import fast_json_dumps, get_checker
+
+SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "id": {"type": "integer"},
+            "name": {"type": "string"},
+            "tags": {"type": "array", "items": {"type": "string"}},
+            "score": {"type": "number"},
+            "ok": {"type": "boolean"},
+        },
+        "required": ["id", "name"],
+        "additionalProperties": False,
+    },
+}
+
+
+def make_payload(size):
+    return [
+        {"id": i, "name": "n%d" % i, "tags": ["a", "b"], "score": i * 0.5, "ok": True}
+        for i in range(size)
+    ]
+
+
+def single_walk(payload):
+    """Validate and encode `payload` in one pass, returning None if invalid."""
+    if not isinstance(payload, list):
+        return None
+    items = []
+    for item in payload:
+        if not isinstance(item, dict) or not ("id" in item and "name" in item):
+            return None
+        fields = []
+        for key in sorted(item):
+            value = item[key]
+            if key == "id":
+                if not (isinstance(value, int) and not isinstance(value, bool)):
+                    return None
+                fields.append('"id":' + int.__repr__(value))
+            elif key == "name":
+                if not isinstance(value, str):
+                    return None
+                fields.append('"name":' + encode_basestring_ascii(value))
+            elif key == "tags":
+                if not isinstance(value, list) or not all(
+                    isinstance(tag, str) for tag in value
+                ):
+                    return None
+                tags = ",".join(map(encode_basestring_ascii, value))
+                fields.append('"tags":[' + tags + "]")
+            elif key == "score":
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    return None
+                fields.append('"score":' + repr(value))
+            elif key == "ok":
+                if not isinstance(value, bool):
+                    return None
+                fields.append('"ok":true' if value else '"ok":false')
+            else:
+                return None
+        items.append("{" + ",".join(fields) + "}")
+    return "[" + ",".join(items) + "]\n"
+
+
+def main():
+    app = flask.Flask(__name__)
+    check = get_checker(SCHEMA, compiled=True)
+    for size in (100, 10000):
+        payload = make_payload(size)
+        expected = json.dumps(payload, sort_keys=True, separators=(",", ":")) + "\n"
+        assert single_walk(payload) == expected
+        number = max(1, 100000 // size)
+        with app.app_context():
+            cases = [
+                ("validate only", lambda: check(payload)),
+                (
+                    "validate + jsonify",
+                    lambda: (check(payload), flask.jsonify(payload)),
+                ),
+                (
+                    "validate + fast_json_dumps",
+                    lambda: (check(payload), fast_json_dumps(payload)),
+                ),
+                ("single walk", lambda: single_walk(payload)),
+            ]
+            for name, fn in cases:
+                best = min(timeit.repeat(fn, number=number, repeat=5)) / number
+                print("{:>6} items  {:<28} {:8.3f}ms".format(size, name, best * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# Copyright 2024 Canonical Ltd.  This software is licensed under the
+# GNU Lesser General Public License version 3 (see the file LICENSE).
+"""Time APIMetadata.serialize() for a large registry.
+
+10k apis in 100 groups, each with a 10-property request schema, a response
+schema and one changelog entry. The first call sorts the schemas and fills
+the per-api caches, later calls reuse them.
+
+Run with: python benchmarks/bench_serialize.py
+"""
+import time
+
+from acceptable._service import AcceptableService, APIMetadata
+
+
+def make_metadata(groups=100, apis_per_group=100):
+    metadata = APIMetadata()
+    properties = {"p%d" % i: {"type": "string"} for i in range(10)}
+    for group in range(groups):
+        service = AcceptableService("service", "g%d" % group, metadata=metadata)
+        for i in range(apis_per_group):
+            name = "api%d_%d" % (group, i)
+            api = service.api("/" + name, name, introduced_at=1)
+            api.request_schema = {"type": "object", "properties": properties}
+            api.response_schema = {"type": "object"}
+            api.changelog(2, "Changed.")
+    return metadata
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    metadata = make_metadata()
+    print("first call:        {:8.1f}ms".format(timed(metadata.serialize)))
+    times = [timed(metadata.serialize) for _ in range(10)]
+    print("unchanged:         {:8.1f}ms to {:.1f}ms".format(min(times), max(times)))
+    api = metadata.get_api("api0_0")
+    api.docs = "Changed."
+    print("one api changed:   {:8.1f}ms".format(timed(metadata.serialize)))
+
+
+if __name__ == "__main__":
+    main()
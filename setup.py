@@ -19,7 +19,7 @@ setup(
     long_description="".join(open("README.rst").readlines()[2:]),
     long_description_content_type="text/x-rst",
     install_requires=["jsonschema", "pyyaml", "Jinja2"],
-    extras_require=dict(flask=["Flask"], django=["django>=2.1,<3"]),
+    extras_require=dict(flask=["Flask"], django=["django>=2.1,<3"], orjson=["orjson"]),
     test_suite="acceptable.tests",
     include_package_data=True,
     entry_points={"console_scripts": ["acceptable = acceptable.__main__:main"]},